@@ -0,0 +1,911 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# 🚦 OFFLINE LOAD HARNESS FOR THE BOT'S UPDATE HANDLERS
+# ==============================================================================
+# Drives the registered handlers in `main` directly with synthetic Message and
+# CallbackQuery objects. Telegram, MongoDB, TMDB and the URL shorteners are
+# replaced by in-process stand-ins with configurable latency, so the numbers
+# reflect the bot's own code path (and any event-loop blocking it does).
+#
+# Updates are fed through a worker pool that mimics Pyrogram's dispatcher.
+# Latency is measured from update arrival to handler completion; throughput
+# also waits for work handed to background tasks (e.g. batch ingest) to finish.
+#
+# Usage:
+#   python benchmarks/load_harness.py --scenario search_burst deep_link --ops 500
+#   python benchmarks/load_harness.py --scenario batch_upload --tmdb-latency-ms 150 --out load.json
+# ==============================================================================
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import itertools
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Dummy config so `main` can be imported without a real bot/database.
+for _key, _value in {
+    "BOT_TOKEN": "0:harness",
+    "API_ID": "1",
+    "API_HASH": "harness",
+    "DATABASE_URI": "mongodb://127.0.0.1:27017",
+}.items():
+    os.environ.setdefault(_key, _value)
+
+import main  # noqa: E402
+
+OWNER_ID = 1
+LOG_CHANNEL_ID = -1001000000000
+BOT_USERNAME = "HarnessBot"
+
+CATALOG_TITLES = [
+    "Inception", "Interstellar", "The Dark Knight", "Oppenheimer", "Dune Part Two",
+    "Breaking Bad", "Money Heist", "Pathaan", "Jawan", "Animal",
+]
+MISSING_TITLES = ["Unknown Movie One", "Lost Tape", "Nowhere Film", "Quiet Street"]
+
+
+# ==============================================================================
+# LATENCY SETTINGS
+# ==============================================================================
+
+class Latency:
+    telegram = 0.0
+    db = 0.0
+    tmdb = 0.0
+    shortener = 0.0
+
+
+async def _tg_delay():
+    if Latency.telegram:
+        await asyncio.sleep(Latency.telegram)
+
+
+# ==============================================================================
+# FAKE TELEGRAM (PYROGRAM) OBJECTS
+# ==============================================================================
+
+_msg_ids = itertools.count(1000)
+_file_ids = itertools.count(1)
+
+
+def _fake_media(kind="video"):
+    n = next(_file_ids)
+    return SimpleNamespace(file_id=f"{kind}_file_{n}", file_unique_id=f"{kind}_uniq_{n}")
+
+
+def _fake_user(uid, name=None):
+    name = name or f"User{uid}"
+    return SimpleNamespace(id=uid, first_name=name, mention=f"[{name}](tg://user?id={uid})")
+
+
+class FakeMessage:
+    def __init__(self, client, chat_id, from_user=None, text=None, command=None,
+                 video=None, document=None, photo=None, caption=None, reply_markup=None,
+                 media_group_id=None):
+        self._client = client
+        self.id = next(_msg_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = from_user
+        self.text = text
+        self.command = command
+        self.video = video
+        self.document = document
+        self.photo = photo
+        self.audio = None
+        self.animation = None
+        self.caption = caption
+        self.reply_markup = reply_markup
+        self.media_group_id = media_group_id
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text, reply_markup=reply_markup)
+
+    async def reply_document(self, document, caption=None, **kwargs):
+        return await self._client.send_document(self.chat.id, document, caption=caption)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        self._client.count("edit_message_text")
+        await _tg_delay()
+        self.text = text
+        self.reply_markup = reply_markup
+        return self
+
+    async def delete(self):
+        return await self._client.delete_messages(self.chat.id, self.id)
+
+    def _copy_of(self, chat_id, caption=None):
+        # Telegram keeps file_unique_id across copies; file_id changes.
+        def same_file(media):
+            return SimpleNamespace(file_id=f"copy_{next(_file_ids)}", file_unique_id=media.file_unique_id) if media else None
+        return FakeMessage(
+            self._client, chat_id, caption=caption,
+            video=same_file(self.video), document=same_file(self.document), photo=self.photo,
+        )
+
+    async def copy(self, chat_id, caption=None, **kwargs):
+        self._client.count("copy_message")
+        await _tg_delay()
+        return self._copy_of(chat_id, caption)
+
+
+class FakeCallbackQuery:
+    def __init__(self, client, user, data, message):
+        self._client = client
+        self.from_user = user
+        self.data = data
+        self.message = message
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        self._client.count("answer_callback_query")
+        await _tg_delay()
+        return True
+
+
+class FakeClient:
+    """Pyrogram `Client` stand-in: records outbound calls and sleeps for latency."""
+
+    def __init__(self):
+        self.calls = {}
+        self.inbox = {}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def _call(self, name):
+        self.count(name)
+        await _tg_delay()
+
+    async def get_me(self):
+        await self._call("get_me")
+        return SimpleNamespace(id=999, username=BOT_USERNAME)
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._call("get_chat_member")
+        return SimpleNamespace(status="member")
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call("send_message")
+        return FakeMessage(self, chat_id, text=text, reply_markup=reply_markup)
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        await self._call("send_document")
+        return FakeMessage(self, chat_id, document=_fake_media("document"), caption=caption)
+
+    async def send_cached_media(self, chat_id, file_id, caption=None, **kwargs):
+        await self._call("send_cached_media")
+        return FakeMessage(self, chat_id, video=SimpleNamespace(file_id=file_id, file_unique_id=file_id), caption=caption)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        await self._call("send_photo")
+        return FakeMessage(self, chat_id, photo=_fake_media("photo"), caption=caption, reply_markup=reply_markup)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, caption=None, **kwargs):
+        await self._call("copy_message")
+        return FakeMessage(self, chat_id, video=_fake_media("video"), caption=caption)
+
+    async def copy_media_group(self, chat_id, from_chat_id, message_id, captions=None, **kwargs):
+        await self._call("copy_media_group")
+        source = self.inbox[message_id]
+        group = sorted(
+            (m for m in self.inbox.values() if m.media_group_id == source.media_group_id and m.chat.id == from_chat_id),
+            key=lambda m: m.id
+        )
+        return [m._copy_of(chat_id) for m in group]
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("delete_messages")
+        return True
+
+    async def get_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("get_messages")
+        return FakeMessage(self, chat_id, reply_markup=SimpleNamespace(inline_keyboard=[]))
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        await self._call("edit_message_reply_markup")
+        return True
+
+    async def get_chat(self, chat_id):
+        await self._call("get_chat")
+        return SimpleNamespace(id=chat_id, username="harness_channel")
+
+    async def download_media(self, message, file_name=None, **kwargs):
+        await self._call("download_media")
+        return file_name
+
+
+# ==============================================================================
+# IN-PROCESS MOTOR-COMPATIBLE STAND-IN
+# ==============================================================================
+
+_object_ids = itertools.count(1)
+
+
+def _get_field(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _match_value(value, present, cond):
+    if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if op == "$regex":
+                flags = re.I if "i" in cond.get("$options", "") else 0
+                if not present or not isinstance(value, str) or not re.search(arg, value, flags):
+                    return False
+            elif op == "$options":
+                continue
+            elif op == "$exists":
+                if bool(arg) != present:
+                    return False
+            elif op == "$in":
+                if value not in arg and not (isinstance(value, list) and set(value) & set(arg)):
+                    return False
+            elif op == "$nin":
+                if value in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if not present or value is None:
+                    return False
+                try:
+                    ok = {"$gt": value > arg, "$gte": value >= arg, "$lt": value < arg, "$lte": value <= arg}[op]
+                except TypeError:
+                    return False
+                if not ok:
+                    return False
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {op}")
+        return True
+    if isinstance(value, list) and not isinstance(cond, list):
+        return cond in value
+    return present and value == cond
+
+
+def _matches(doc, query):
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(_matches(doc, q) for q in cond):
+                return False
+            continue
+        value, present = _get_field(doc, key)
+        if not _match_value(value, present, cond):
+            return False
+    return True
+
+
+def _set_field(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _apply_update(doc, update, inserting):
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for key, value in fields.items():
+            current, present = _get_field(doc, key)
+            if op in ("$set", "$setOnInsert"):
+                _set_field(doc, key, value)
+            elif op == "$inc":
+                _set_field(doc, key, (current or 0) + value)
+            elif op == "$max":
+                _set_field(doc, key, value if not present or value > current else current)
+            elif op == "$addToSet":
+                items = list(current or [])
+                for item in (value["$each"] if isinstance(value, dict) and "$each" in value else [value]):
+                    if item not in items:
+                        items.append(item)
+                _set_field(doc, key, items)
+            elif op == "$push":
+                _set_field(doc, key, list(current or []) + [value])
+            elif op == "$pull":
+                _set_field(doc, key, [v for v in (current or []) if v != value])
+            elif op == "$unset":
+                parent, _ = _get_field(doc, key.rsplit(".", 1)[0]) if "." in key else (doc, True)
+                if isinstance(parent, dict):
+                    parent.pop(key.rsplit(".", 1)[-1], None)
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {op}")
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {k: 1 for k in projection}
+    include = {k for k, v in projection.items() if v}
+    if include:
+        out = {k: doc[k] for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: v for k, v in doc.items() if k not in projection}
+
+
+class FakeResult(SimpleNamespace):
+    pass
+
+
+class FakeCursor:
+    def __init__(self, collection, docs):
+        self._collection = collection
+        self._docs = docs
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (_get_field(d, field)[0] is None, _get_field(d, field)[0]), reverse=order < 0)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def _result(self):
+        docs = self._docs[self._skip:]
+        return docs[:self._limit] if self._limit else docs
+
+    async def to_list(self, length=None):
+        await self._collection._delay()
+        docs = self._result()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection._delay()
+        for doc in self._result():
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, name, stats):
+        self.name = name
+        self.docs = {}
+        self._stats = stats
+
+    async def _delay(self, op=None):
+        if op:
+            self._stats[f"{self.name}.{op}"] = self._stats.get(f"{self.name}.{op}", 0) + 1
+        if Latency.db:
+            await asyncio.sleep(Latency.db)
+
+    def _find_docs(self, query):
+        return [d for d in self.docs.values() if _matches(d, query)]
+
+    def _insert(self, doc):
+        doc.setdefault("_id", f"oid{next(_object_ids):024d}")
+        if doc["_id"] in self.docs:
+            raise KeyError(f"duplicate _id {doc['_id']}")
+        self.docs[doc["_id"]] = doc
+        return doc["_id"]
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        await self._delay("find_one")
+        docs = self._find_docs(query)
+        return _project(docs[0], projection) if docs else None
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._stats[f"{self.name}.find"] = self._stats.get(f"{self.name}.find", 0) + 1
+        return FakeCursor(self, [_project(d, projection) for d in self._find_docs(query)])
+
+    async def insert_one(self, doc):
+        await self._delay("insert_one")
+        return FakeResult(inserted_id=self._insert(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        await self._delay("insert_many")
+        return FakeResult(inserted_ids=[self._insert(d) for d in docs])
+
+    async def _update(self, query, update, upsert, many):
+        docs = self._find_docs(query)
+        if not docs:
+            if not upsert:
+                return FakeResult(matched_count=0, modified_count=0, upserted_id=None)
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            _apply_update(doc, update, inserting=True)
+            return FakeResult(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+        for doc in (docs if many else docs[:1]):
+            _apply_update(doc, update, inserting=False)
+        return FakeResult(matched_count=len(docs), modified_count=len(docs), upserted_id=None)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        await self._delay("update_one")
+        return await self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        await self._delay("update_many")
+        return await self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query, doc, upsert=False, **kwargs):
+        await self._delay("replace_one")
+        existing = self._find_docs(query)
+        if existing:
+            self.docs[existing[0]["_id"]] = {**doc, "_id": existing[0]["_id"]}
+            return FakeResult(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            return FakeResult(matched_count=0, modified_count=0, upserted_id=self._insert(dict(doc)))
+        return FakeResult(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=False, projection=None, sort=None, **kwargs):
+        await self._delay("find_one_and_update")
+        docs = self._find_docs(query)
+        if sort:
+            docs = await FakeCursor(self, docs).sort(sort).to_list()
+        if not docs:
+            if not upsert:
+                return None
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            _apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            return _project(doc, projection) if return_document else None
+        before = dict(docs[0])
+        _apply_update(docs[0], update, inserting=False)
+        return _project(docs[0] if return_document else before, projection)
+
+    async def delete_one(self, query):
+        await self._delay("delete_one")
+        docs = self._find_docs(query)
+        if docs:
+            del self.docs[docs[0]["_id"]]
+        return FakeResult(deleted_count=len(docs[:1]))
+
+    async def delete_many(self, query):
+        await self._delay("delete_many")
+        docs = self._find_docs(query)
+        for doc in docs:
+            del self.docs[doc["_id"]]
+        return FakeResult(deleted_count=len(docs))
+
+    async def count_documents(self, query, **kwargs):
+        await self._delay("count_documents")
+        return len(self._find_docs(query))
+
+    async def estimated_document_count(self, **kwargs):
+        await self._delay("estimated_document_count")
+        return len(self.docs)
+
+    async def create_index(self, keys, **kwargs):
+        await self._delay("create_index")
+        return str(keys)
+
+    async def create_indexes(self, indexes, **kwargs):
+        await self._delay("create_indexes")
+        return [str(getattr(i, "document", i)) for i in indexes]
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._delay("bulk_write")
+        for req in requests:
+            kind = type(req).__name__
+            doc = getattr(req, "_doc", None)
+            query = getattr(req, "_filter", None)
+            upsert = bool(getattr(req, "_upsert", False))
+            if kind == "InsertOne":
+                self._insert(dict(doc))
+            elif kind == "UpdateOne":
+                await self._update(query, doc, upsert, many=False)
+            elif kind == "UpdateMany":
+                await self._update(query, doc, upsert, many=True)
+            elif kind == "ReplaceOne":
+                await self.replace_one(query, doc, upsert=upsert)
+            elif kind == "DeleteOne":
+                await self.delete_one(query)
+        return FakeResult(acknowledged=True)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.stats = {}
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.stats)
+        return self._collections[name]
+
+    async def command(self, *args, **kwargs):
+        await FakeCollection("admin", self.stats)._delay("command")
+        return {"ok": 1}
+
+
+# ==============================================================================
+# STUBBED TMDB & SHORTENER "SERVERS"
+# ==============================================================================
+
+class StubResponse:
+    def __init__(self, payload=None, content=b""):
+        self._payload = payload
+        self.content = content
+        self.status_code = 200
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        return None
+
+
+class StubHTTP:
+    """Replaces `main.requests`; blocking like the real library, latency via time.sleep."""
+
+    def __init__(self):
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get(self, url, timeout=None, **kwargs):
+        parsed = urlparse(url)
+        params = parse_qs(parsed.query)
+        if parsed.netloc == "api.themoviedb.org":
+            self._count("tmdb")
+            time.sleep(Latency.tmdb)
+            return StubResponse(self._tmdb(parsed.path, params))
+        if parsed.netloc == "image.tmdb.org":
+            self._count("tmdb_image")
+            time.sleep(Latency.tmdb)
+            return StubResponse(content=b"")
+        self._count("shortener")
+        time.sleep(Latency.shortener)
+        long_url = params.get("url", [""])[0]
+        digest = hashlib.md5(long_url.encode()).hexdigest()[:8]
+        return StubResponse({"status": "success", "shortenedUrl": f"https://{parsed.netloc}/{digest}"})
+
+    @staticmethod
+    def _tmdb(path, params):
+        def item(i, title):
+            return {"id": 1000 + i, "media_type": "movie", "title": title,
+                    "release_date": "2023-07-21", "vote_average": 7.9, "poster_path": None}
+
+        if path.startswith("/3/search/multi"):
+            query = params.get("query", [""])[0]
+            return {"results": [item(0, query.title())]}
+        if path.startswith("/3/trending"):
+            return {"results": [item(i, t) for i, t in enumerate(CATALOG_TITLES)]}
+        if path.endswith("/videos"):
+            return {"results": [{"site": "YouTube", "type": "Trailer", "key": "abc123"}]}
+        if path.startswith("/3/find/"):
+            return {"movie_results": [item(0, CATALOG_TITLES[0])], "tv_results": []}
+        m = re.match(r"/3/(movie|tv)/(\d+)$", path)
+        if m:
+            idx = int(m.group(2)) - 1000
+            title = CATALOG_TITLES[idx] if 0 <= idx < len(CATALOG_TITLES) else f"Title {idx}"
+            return {**item(idx, title), "genres": [{"name": "Action"}, {"name": "Drama"}]}
+        return {}
+
+
+# ==============================================================================
+# EVENT LOOP LAG MONITOR
+# ==============================================================================
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+# ==============================================================================
+# ENVIRONMENT WIRING
+# ==============================================================================
+
+class Harness:
+    def __init__(self):
+        self.client = FakeClient()
+        self.db = FakeDatabase()
+        self.http = StubHTTP()
+        self.codes = []
+
+    def install(self):
+        main.bot = self.client
+        main.db = self.db
+        # Swap every module-level Motor collection for its in-process twin.
+        for attr in dir(main):
+            if attr.endswith("_collection"):
+                setattr(main, attr, self.db[getattr(main, attr).name])
+        main.requests = self.http
+        main.OWNER_ID = OWNER_ID
+        main.LOG_CHANNEL_ID = LOG_CHANNEL_ID
+        main.BOT_USERNAME = BOT_USERNAME
+        main.FORCE_SUB_CHANNEL = None
+        main.BLOG_URL = ""
+        main.user_conversations.clear()
+
+    def seed(self, n_files=200, n_uploaders=5):
+        for u in range(n_uploaders):
+            self.db.users.docs[100 + u] = {
+                "_id": 100 + u, "first_name": f"Uploader{u}", "is_premium": True, "delete_timer": 0,
+                "shortener_api": "key", "shortener_url": f"short{u}.example",
+            }
+        for i in range(n_files):
+            title = CATALOG_TITLES[i % len(CATALOG_TITLES)]
+            code = f"code{i:05d}"
+            self.codes.append(code)
+            self.db.files.docs[code] = {
+                "_id": code, "code": code, "file_id": f"seed_file_{i}", "file_unique_id": f"seed_uniq_{i}",
+                "log_msg_id": 10 + i, "delete_timer": 0, "uploader_id": 100 + (i % n_uploaders),
+                "caption": (f"🎬 **{title} (2023)**\n🔰 **Quality:** {['480p', '720p', '1080p'][i % 3]}\n"
+                            f"🔊 **Language:** Hindi\n🎭 **Genre:** Action\n━━━━━━━━━━━━━━━━━━\n🤖 @{BOT_USERNAME}"),
+                "created_at": datetime.now(),
+            }
+
+    def message(self, uid, text=None, command=None, video=False, media_group_id=None):
+        msg = FakeMessage(self.client, uid, from_user=_fake_user(uid), text=text, command=command,
+                          video=_fake_media("video") if video else None, media_group_id=media_group_id)
+        if media_group_id:
+            self.client.inbox[msg.id] = msg
+        return msg
+
+    def callback(self, uid, data):
+        origin = FakeMessage(self.client, uid, text="panel")
+        return FakeCallbackQuery(self.client, _fake_user(uid), data, origin)
+
+    def batch_session(self, uid):
+        main.user_conversations[uid] = {
+            "details": {"title": "Harness Series", "first_air_date": "2024-01-01", "media_type": "tv",
+                        "genres": [{"name": "Drama"}]},
+            "links": {}, "language": "Hindi", "state": "wait_file_upload", "is_manual": False,
+            "is_batch_mode": True, "batch_season_prefix": "S1", "episode_count": 1, "current_quality": "batch",
+        }
+
+
+# ==============================================================================
+# SCENARIOS
+# ==============================================================================
+# Each scenario returns a list of (user_id, coroutine factory) updates.
+
+def scenario_search_burst(h, ops):
+    queries = CATALOG_TITLES + MISSING_TITLES
+    updates = []
+    for i in range(ops):
+        uid = 10_000 + i
+        text = queries[i % len(queries)]
+        updates.append((uid, lambda uid=uid, text=text: main.main_conversation_handler(h.client, h.message(uid, text=text))))
+    return updates
+
+
+def scenario_deep_link(h, ops):
+    updates = []
+    for i in range(ops):
+        uid = 20_000 + (i % max(1, ops // 4))
+        code = h.codes[(i * 7) % len(h.codes)]
+        updates.append((uid, lambda uid=uid, code=code: main.start_cmd(h.client, h.message(uid, text=f"/start {code}", command=["start", code]))))
+    return updates
+
+
+def scenario_menu(h, ops):
+    updates = []
+    for i in range(ops):
+        uid = 30_000 + i
+        updates.append((uid, lambda uid=uid: main.start_cmd(h.client, h.message(uid, text="/start", command=["start"]))))
+    return updates
+
+
+def scenario_batch_upload(h, ops, episodes=12):
+    updates = []
+    users = max(1, ops // episodes)
+    for u in range(users):
+        uid = 100 + (u % 5)
+        h.batch_session(uid)
+        for _ in range(episodes):
+            updates.append((uid, lambda uid=uid: main.main_conversation_handler(h.client, h.message(uid, video=True))))
+    return updates
+
+
+def scenario_album_upload(h, ops, album_size=10):
+    updates = []
+    albums = max(1, ops // album_size)
+    for a in range(albums):
+        uid = 100 + (a % 5)
+        h.batch_session(uid)
+        group_id = f"album{a}"
+        for _ in range(album_size):
+            updates.append((uid, lambda uid=uid, group_id=group_id: main.main_conversation_handler(
+                h.client, h.message(uid, video=True, media_group_id=group_id))))
+    return updates
+
+
+def scenario_callbacks(h, ops):
+    updates = []
+    data_mix = ["my_account", "api_help", "admin_stats"]
+    for i in range(ops):
+        data = data_mix[i % len(data_mix)]
+        uid = OWNER_ID if data == "admin_stats" else 40_000 + i
+        updates.append((uid, lambda uid=uid, data=data: main.callback_handler(h.client, h.callback(uid, data))))
+    return updates
+
+
+SCENARIOS = {
+    "search_burst": scenario_search_burst,
+    "deep_link": scenario_deep_link,
+    "menu": scenario_menu,
+    "batch_upload": scenario_batch_upload,
+    "album_upload": scenario_album_upload,
+    "callbacks": scenario_callbacks,
+}
+
+
+async def finalize(h):
+    """Wait for work handlers hand off to background tasks (user queues, batch ingest, buffered writes)."""
+    await main.dispatcher.wait_idle()
+    for convo in list(main.user_conversations.values()):
+        await main.finish_ingest(convo)
+    await main.flush_user_updates()
+    await main.analytics.flush()
+
+
+# ==============================================================================
+# DRIVER & REPORTING
+# ==============================================================================
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def run_scenario(name, ops, workers, rate):
+    h = Harness()
+    h.install()
+    h.seed()
+    updates = SCENARIOS[name](h, ops)
+
+    queue = asyncio.Queue()
+    latencies, errors = [], []
+    monitor = LoopLagMonitor()
+    loop = asyncio.get_running_loop()
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            arrived, uid, factory = item
+            try:
+                # Serialized handlers return the future of their queued run.
+                pending = await factory()
+                if asyncio.isfuture(pending):
+                    await pending
+            except Exception as e:
+                if not errors:
+                    logging.exception("First handler error in scenario %s", name)
+                errors.append(repr(e))
+            latencies.append(loop.time() - arrived)
+
+    monitor.start()
+    started = loop.time()
+    pool = [asyncio.create_task(worker()) for _ in range(workers)]
+    for uid, factory in updates:
+        queue.put_nowait((loop.time(), uid, factory))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    for _ in pool:
+        queue.put_nowait(None)
+    await asyncio.gather(*pool)
+    await finalize(h)
+    elapsed = loop.time() - started
+    await monitor.stop()
+
+    ms = [v * 1000 for v in latencies]
+    lag = [v * 1000 for v in monitor.samples]
+    return {
+        "scenario": name,
+        "ops": len(updates),
+        "errors": len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_ops_s": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {"p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99), "max": max(ms, default=0.0)},
+        "loop_lag_ms": {"p50": percentile(lag, 50), "p99": percentile(lag, 99), "max": max(lag, default=0.0)},
+        "telegram_calls": dict(h.client.calls),
+        "db_ops": dict(h.db.stats),
+        "http_calls": dict(h.http.calls),
+    }
+
+
+def print_report(results):
+    print(f"\n{'scenario':<14} {'ops':>6} {'err':>4} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'lag max':>8}")
+    for r in results:
+        lat, lag = r["latency_ms"], r["loop_lag_ms"]
+        print(f"{r['scenario']:<14} {r['ops']:>6} {r['errors']:>4} {r['throughput_ops_s']:>9.1f} "
+              f"{lat['p50']:>8.1f} {lat['p95']:>8.1f} {lat['p99']:>8.1f} {lag['p99']:>8.1f} {lag['max']:>8.1f}")
+
+
+async def run_all(args):
+    Latency.telegram = args.tg_latency_ms / 1000
+    Latency.db = args.db_latency_ms / 1000
+    Latency.tmdb = args.tmdb_latency_ms / 1000
+    Latency.shortener = args.shortener_latency_ms / 1000
+
+    results = []
+    for name in args.scenario:
+        result = await run_scenario(name, args.ops, args.workers, args.rate)
+        results.append(result)
+        print(f"✓ {name}: {result['throughput_ops_s']} ops/s, p99 {result['latency_ms']['p99']:.1f} ms", flush=True)
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot's update handlers.")
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["search_burst", "deep_link", "callbacks"])
+    parser.add_argument("--ops", type=int, default=300, help="Updates per scenario")
+    parser.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 0) + 4), help="Concurrent dispatcher workers")
+    parser.add_argument("--rate", type=float, default=0, help="Arrival rate in updates/s (0 = single burst)")
+    parser.add_argument("--tg-latency-ms", type=float, default=40)
+    parser.add_argument("--db-latency-ms", type=float, default=2)
+    parser.add_argument("--tmdb-latency-ms", type=float, default=120)
+    parser.add_argument("--shortener-latency-ms", type=float, default=200)
+    parser.add_argument("--out", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(run_all(args))
+    print_report(results)
+
+    if args.out:
+        report = {"config": vars(args), "timestamp": datetime.now().isoformat(timespec="seconds"), "results": results}
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📦 Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
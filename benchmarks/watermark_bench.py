@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# 🖼️ WATERMARK RENDER BENCHMARK
+# ==============================================================================
+# Renders synthetic posters through `main.watermark_poster` at several
+# resolutions, with and without badge / watermark / face detection, and records
+# wall time, CPU time, peak RSS and output size for every case.
+#
+# Every case runs in a fresh process so peak RSS is per case, not cumulative.
+# Nothing is downloaded: the font and the Haar cascade must exist locally.
+#
+# Usage:
+#   python benchmarks/watermark_bench.py --font HindSiliguri-Bold.ttf \
+#       --cascade haarcascade_frontalface_default.xml --out bench.json
+#   python benchmarks/watermark_bench.py ... --compare old_bench.json
+# ==============================================================================
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import statistics
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = ["500x750", "1000x1500", "2000x3000"]
+BADGE_TEXT = "4K HDR Dual Audio"
+WATERMARK_TEXT = "@MovieChannel"
+
+# Dummy config so `main` can be imported without a real bot/database.
+BENCH_ENV = {
+    "BOT_TOKEN": "0:benchmark",
+    "API_ID": "1",
+    "API_HASH": "benchmark",
+    "DATABASE_URI": "mongodb://127.0.0.1:27017",
+}
+
+
+# ==============================================================================
+# SYNTHETIC INPUTS
+# ==============================================================================
+
+def make_poster(width, height, face_path=None, seed=1234):
+    """Deterministic poster-like JPEG: gradient, noise and a few shapes."""
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    rng = np.random.RandomState(seed)
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = np.empty((height, width, 3), dtype=np.float32)
+    base[..., 0] = 40 + 150 * ys + 30 * xs
+    base[..., 1] = 20 + 80 * (1 - ys) + 60 * xs
+    base[..., 2] = 90 + 120 * xs * (1 - ys)
+    base += rng.normal(0, 18, size=base.shape)
+    img = Image.fromarray(np.clip(base, 0, 255).astype("uint8"), "RGB")
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(width // 20, width // 5)
+        color = tuple(int(c) for c in rng.randint(0, 255, size=3))
+        draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=color)
+
+    if face_path:
+        face = Image.open(face_path).convert("RGB")
+        fw = width // 3
+        fh = int(face.height * fw / face.width)
+        face = face.resize((fw, fh))
+        img.paste(face, ((width - fw) // 2, int(height * 0.02)))
+
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def build_cases(sizes, with_face):
+    cases = []
+    face_modes = ["off", "scan"] + (["face"] if with_face else [])
+    for size in sizes:
+        for badge in (False, True):
+            for watermark in (False, True):
+                # Face detection only runs when a badge is drawn.
+                for faces in (face_modes if badge else ["off"]):
+                    name = f"{size}-badge_{'on' if badge else 'off'}-wm_{'on' if watermark else 'off'}-faces_{faces}"
+                    cases.append({"name": name, "size": size, "badge": badge, "watermark": watermark, "faces": faces})
+    return cases
+
+
+# ==============================================================================
+# CASE RUNNER (executes in a fresh child process)
+# ==============================================================================
+
+def _rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux.
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(case, font, cascade, face_path, repeats, warmup):
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["FONT_FILE"] = font
+    os.environ["CASCADE_FILE"] = cascade
+
+    import main
+
+    if case["faces"] == "off":
+        # Skip detection entirely instead of falling back to a download.
+        main.download_cascade = lambda: None
+
+    width, height = (int(v) for v in case["size"].split("x"))
+    poster = make_poster(width, height, face_path if case["faces"] == "face" else None)
+    badge = BADGE_TEXT if case["badge"] else None
+    watermark = WATERMARK_TEXT if case["watermark"] else ""
+
+    for _ in range(warmup):
+        main.watermark_poster(io.BytesIO(poster), watermark, badge)
+
+    rss_before = _rss_kb()
+    walls, cpus, out_bytes, error = [], [], 0, None
+    for _ in range(repeats):
+        w0, c0 = time.perf_counter(), time.process_time()
+        buffer, error = main.watermark_poster(io.BytesIO(poster), watermark, badge)
+        cpus.append((time.process_time() - c0) * 1000)
+        walls.append((time.perf_counter() - w0) * 1000)
+        if buffer is None:
+            break
+        out_bytes = buffer.getbuffer().nbytes
+
+    return {
+        **case,
+        "repeats": len(walls),
+        "error": error,
+        "input_bytes": len(poster),
+        "output_bytes": out_bytes,
+        "wall_ms": {"median": statistics.median(walls), "min": min(walls), "mean": statistics.fmean(walls)},
+        "cpu_ms": {"median": statistics.median(cpus), "min": min(cpus), "mean": statistics.fmean(cpus)},
+        "rss_before_kb": rss_before,
+        "peak_rss_kb": _rss_kb(),
+    }
+
+
+# ==============================================================================
+# REPORTING
+# ==============================================================================
+
+def collect_meta():
+    import PIL
+    import numpy
+    import cv2
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def print_table(results):
+    print(f"{'case':<52} {'wall ms':>9} {'cpu ms':>9} {'peak MB':>8} {'out KB':>8}")
+    for r in results:
+        flag = f"  ERROR: {r['error']}" if r["error"] else ""
+        print(f"{r['name']:<52} {r['wall_ms']['median']:>9.1f} {r['cpu_ms']['median']:>9.1f} "
+              f"{r['peak_rss_kb'] / 1024:>8.1f} {r['output_bytes'] / 1024:>8.1f}{flag}")
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {c["name"]: c for c in json.load(f)["cases"]}
+
+    regressions = []
+    print(f"\n{'case':<52} {'old ms':>9} {'new ms':>9} {'ratio':>7}")
+    for r in results:
+        old = baseline.get(r["name"])
+        if not old:
+            continue
+        ratio = r["wall_ms"]["median"] / old["wall_ms"]["median"] if old["wall_ms"]["median"] else 0
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  ⚠️ slower"
+            regressions.append(r["name"])
+        print(f"{r['name']:<52} {old['wall_ms']['median']:>9.1f} {r['wall_ms']['median']:>9.1f} {ratio:>6.2f}x{mark}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark watermark_poster rendering.")
+    parser.add_argument("--font", required=True, help="Local path to HindSiliguri-Bold.ttf")
+    parser.add_argument("--cascade", required=True, help="Local path to haarcascade_frontalface_default.xml")
+    parser.add_argument("--face-image", help="Optional photo with a face, pasted into 'faces_face' cases")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Poster sizes as WxH")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--filter", help="Only run cases whose name contains this text")
+    parser.add_argument("--out", default="bench_watermark.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown ratio before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    for label, path in (("font", args.font), ("cascade", args.cascade), ("face image", args.face_image)):
+        if path and not os.path.isfile(path):
+            parser.error(f"{label} not found: {path}")
+
+    cases = build_cases(args.sizes, bool(args.face_image))
+    if args.filter:
+        cases = [c for c in cases if args.filter in c["name"]]
+
+    font = os.path.abspath(args.font)
+    cascade = os.path.abspath(args.cascade)
+    face = os.path.abspath(args.face_image) if args.face_image else None
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(run_case, case, font, cascade, face, args.repeats, args.warmup).result()
+        results.append(result)
+        print(f"✓ {case['name']}: {result['wall_ms']['median']:.1f} ms", flush=True)
+
+    report = {"meta": collect_meta(), "config": {"repeats": args.repeats, "warmup": args.warmup}, "cases": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_table(results)
+    print(f"\n📦 Results saved to {args.out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -27,18 +27,28 @@ import secrets
 import string
 import time
 import json
-from threading import Thread
-from datetime import datetime
+import gzip
+import shutil
+import tempfile
+import itertools
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime, timedelta
+from collections import OrderedDict, deque
 
 # --- Third-party Library Imports ---
 import requests
 from PIL import Image, ImageDraw, ImageFont
-from pyrogram import Client, filters, enums
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
 from pyrogram.errors import UserNotParticipant, FloodWait, MessageNotModified
-from flask import Flask
+from aiohttp import web
 from dotenv import load_dotenv
 import motor.motor_asyncio
+from bson import json_util, ObjectId
+from pymongo import monitoring, IndexModel, ASCENDING, DESCENDING, ReplaceOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 import numpy as np
 import cv2 
 
@@ -64,11 +74,64 @@ LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID", "0"))
 # ------------------------------------------------------------------------------
 # 🌐 BLOGGER / WEBSITE REDIRECT CONFIGURATION
 # ------------------------------------------------------------------------------
+# BLOG_URL may also point at this bot's own web server: "/?code=..." is resolved
+# locally and redirected straight to the bot, no Blogger hop needed.
 BLOG_URL = os.getenv("BLOG_URL", "") 
+REDIRECT_CACHE_TTL = int(os.getenv("REDIRECT_CACHE_TTL", "3600"))
+
+# Deep-link delivery cache (code -> file_id, log_msg_id, caption, timer)
+DELIVERY_CACHE_SIZE = int(os.getenv("DELIVERY_CACHE_SIZE", "50000"))
+DELIVERY_CACHE_TTL = int(os.getenv("DELIVERY_CACHE_TTL", "21600"))
+
+# Auto-Reply Search Admission (per-user bucket: SEARCH_BURST searches, refilled at SEARCH_RATE/s)
+SEARCH_RATE = float(os.getenv("SEARCH_RATE", "0.1"))
+SEARCH_BURST = int(os.getenv("SEARCH_BURST", "3"))
+SEARCH_DEBOUNCE = float(os.getenv("SEARCH_DEBOUNCE", "10"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "8"))
+SEARCH_QUEUE_LIMIT = int(os.getenv("SEARCH_QUEUE_LIMIT", "50"))
+
+# TMDB Caches & Trending Warmer
+TMDB_CACHE_TTL = int(os.getenv("TMDB_CACHE_TTL", "21600"))
+POSTER_CACHE_SIZE = int(os.getenv("POSTER_CACHE_SIZE", "100"))
+TRENDING_REFRESH_INTERVAL = int(os.getenv("TRENDING_REFRESH_INTERVAL", "300"))
+TRENDING_PREFETCH = int(os.getenv("TRENDING_PREFETCH", "10"))
+
+# Render Resources (local paths; downloaded on first use if missing)
+FONT_FILE = os.getenv("FONT_FILE", "HindSiliguri-Bold.ttf")
+CASCADE_FILE = os.getenv("CASCADE_FILE", "haarcascade_frontalface_default.xml")
 
 # Database Configuration
 DB_URI = os.getenv("DATABASE_URI")
 DB_NAME = os.getenv("DATABASE_NAME", "MovieBotDB")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "21600"))
+SEEN_USERS_SIZE = int(os.getenv("SEEN_USERS_SIZE", "100000"))
+SEEN_USERS_TTL = int(os.getenv("SEEN_USERS_TTL", "86400"))
+USER_FLUSH_INTERVAL = int(os.getenv("USER_FLUSH_INTERVAL", "30"))
+ANALYTICS_FLUSH_INTERVAL = int(os.getenv("ANALYTICS_FLUSH_INTERVAL", "60"))
+REQUEST_DIGEST_INTERVAL = int(os.getenv("REQUEST_DIGEST_INTERVAL", "3600"))
+REQUEST_DIGEST_SIZE = int(os.getenv("REQUEST_DIGEST_SIZE", "20"))
+FULFILL_NOTIFY_RATE = float(os.getenv("FULFILL_NOTIFY_RATE", "5"))
+BACKUP_PART_SIZE = int(os.getenv("BACKUP_PART_MB", "1900")) * 1024 * 1024
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+MEDIA_GROUP_WAIT = float(os.getenv("MEDIA_GROUP_WAIT", "1.5"))
+
+# Scheduled Posts (seconds between two queued posts in the same channel)
+POST_SLOT_INTERVAL = int(os.getenv("POST_SLOT_INTERVAL", "900"))
+SCHEDULE_POLL_INTERVAL = int(os.getenv("SCHEDULE_POLL_INTERVAL", "15"))
+
+# Update Dispatch (updates are serialized per user, so workers can be raised safely)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "32"))
+USER_QUEUE_SIZE = int(os.getenv("USER_QUEUE_SIZE", "100"))
+
+# Outbound Telegram Rate Limits (messages per second)
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "25"))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "30"))
+OUTBOUND_BULK_RESERVE = int(os.getenv("OUTBOUND_BULK_RESERVE", "5"))
+CHAT_RATE = float(os.getenv("CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("CHAT_BURST", "4"))
+FLOOD_SLEEP_INTERACTIVE = int(os.getenv("FLOOD_SLEEP_INTERACTIVE", "30"))
+FLOOD_SLEEP_BULK = int(os.getenv("FLOOD_SLEEP_BULK", "600"))
 
 # Logging Setup
 logging.basicConfig(
@@ -82,38 +145,350 @@ if not DB_URI:
     logger.critical("CRITICAL: DATABASE_URI is not set. Bot cannot start.")
     exit()
 
+# ==============================================================================
+# METRICS (PROMETHEUS)
+# ==============================================================================
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Time spent handling one update", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Updates whose handler raised", ["handler"])
+DEPENDENCY_LATENCY = Histogram("bot_dependency_seconds", "Outbound HTTP call latency", ["dependency", "operation"])
+DEPENDENCY_ERRORS = Counter("bot_dependency_errors_total", "Failed outbound HTTP calls", ["dependency", "operation"])
+MONGO_LATENCY = Histogram(
+    "bot_mongo_command_seconds", "MongoDB command latency", ["collection", "command"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+MONGO_ERRORS = Counter("bot_mongo_command_errors_total", "Failed MongoDB commands", ["collection", "command"])
+MONGO_SLOW = Counter("bot_mongo_slow_commands_total", "MongoDB commands slower than SLOW_QUERY_MS", ["collection", "command"])
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "In-memory cache lookups", ["cache", "result"])
+FILE_DELIVERIES = Counter("bot_file_deliveries_total", "Deep-link file deliveries by path", ["path"])
+FILE_DEDUP = Counter("bot_upload_dedup_total", "Uploads resolved to an existing file by file_unique_id")
+OUTBOUND_WAIT = Histogram("bot_outbound_wait_seconds", "Time outbound calls waited for a send slot", ["priority"])
+FLOOD_WAITS = Counter("bot_flood_waits_total", "FloodWait errors returned by Telegram", ["method", "priority"])
+USER_QUEUE_DEPTH = Gauge("bot_user_queue_depth", "Updates waiting in per-user dispatch queues")
+USER_QUEUE_DROPS = Counter("bot_user_queue_drops_total", "Updates dropped because a user's queue was full")
+SEARCH_ADMISSION = Counter("bot_search_admission_total", "Auto-reply searches by admission outcome", ["outcome"])
+SINGLEFLIGHT_CALLS = Counter(
+    "bot_singleflight_calls_total", "Coalesced calls: 'led' ran the request, 'shared' reused one in flight", ["call", "result"]
+)
+CHANNEL_POSTS = Counter("bot_channel_posts_total", "Posts published to user channels", ["result"])
+FILE_ID_REPAIRS = Counter("bot_file_id_repairs_total", "Stored file_id write-backs after a cached send failed", ["outcome"])
+REDIRECTS = Counter("bot_redirects_total", "?code= redirect requests", ["outcome"])
+RENDER_LATENCY = Histogram("bot_render_seconds", "Poster watermark render time")
+ACTIVE_SESSIONS = Gauge("bot_active_sessions", "Entries in user_conversations")
+PENDING_TASKS = Gauge("bot_pending_tasks", "Unfinished asyncio tasks on the bot loop")
+
+def query_shape(value):
+    """Replace literal values with '?' so filters group by shape, not by data."""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(v) for v in value[:3]]
+    return "?"
+
+def command_filter(command_name, command):
+    if command_name == "find":
+        return {"filter": command.get("filter"), "sort": command.get("sort")}
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query")
+    if command_name == "aggregate":
+        return command.get("pipeline")
+    if command_name in ("update", "delete"):
+        ops = command.get("updates") or command.get("deletes") or []
+        return ops[0].get("q") if ops else None
+    return None
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command and logs the filter shape of slow ones."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self._inflight[(event.connection_id, event.request_id)] = (collection, event.command)
+
+    def _finish(self, event):
+        collection, command = self._inflight.pop((event.connection_id, event.request_id), ("-", None))
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.labels(collection, event.command_name).observe(seconds)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            MONGO_SLOW.labels(collection, event.command_name).inc()
+            shape = query_shape(command_filter(event.command_name, command or {}))
+            logger.warning(f"🐢 Slow Mongo {event.command_name} on {collection}: {seconds * 1000:.0f} ms | shape={shape}")
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_ERRORS.labels(collection, event.command_name).inc()
+
 # Initialize MongoDB Client
-db_client = motor.motor_asyncio.AsyncIOMotorClient(DB_URI)
+db_client = motor.motor_asyncio.AsyncIOMotorClient(DB_URI, event_listeners=[MongoMetricsListener()])
 db = db_client[DB_NAME]
 users_collection = db.users
 files_collection = db.files
 requests_collection = db.requests 
+stats_collection = db.stats
+backups_collection = db.backups
+scheduled_collection = db.scheduled_posts
+file_stats_collection = db.file_stats_daily
+uploader_stats_collection = db.uploader_stats_daily
 
 # Global Variables
 user_conversations = {}
 BOT_USERNAME = ""
 
+# ==============================================================================
+# OUTBOUND SCHEDULER (GLOBAL + PER-CHAT RATE LIMITS)
+# ==============================================================================
+# Every API call goes through ScheduledClient.invoke. Sends, edits and deletes
+# take a token from the global bucket and from the target chat's bucket first.
+# Bulk traffic (broadcasts, channel fan-out, log/alert messages, auto-deletes)
+# may not use the last OUTBOUND_BULK_RESERVE global tokens, so user replies
+# never queue behind a mass send. FloodWait is handled here for every call.
+# Scheduled posts are bulk traffic that never waits out a FloodWait: the
+# publisher re-queues the post and moves on to the next channel instead.
+RATE_LIMITED_METHODS = {
+    "SendMessage", "SendMedia", "SendMultiMedia", "ForwardMessages",
+    "EditMessage", "DeleteMessages",
+}
+MAX_CHAT_BUCKETS = 10000
+
+outbound_priority = contextvars.ContextVar("outbound_priority", default="interactive")
+
+@contextmanager
+def bulk_traffic():
+    """Mark outbound calls made inside this block (and tasks created in it) as bulk."""
+    token = outbound_priority.set("bulk")
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+@contextmanager
+def scheduled_traffic():
+    """Like bulk_traffic(), but FloodWait is raised at once instead of slept on."""
+    token = outbound_priority.set("scheduled")
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+FLOOD_SLEEP_LIMITS = {"interactive": FLOOD_SLEEP_INTERACTIVE, "bulk": FLOOD_SLEEP_BULK, "scheduled": 0}
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self, floor: int = 0) -> float:
+        """Seconds until a token above `floor` is free (0 = available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (floor + 1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+def query_chat(query):
+    peer = getattr(query, "peer", None) or getattr(query, "to_peer", None) or getattr(query, "channel", None)
+    if peer is None:
+        return None
+    return getattr(peer, "user_id", None) or getattr(peer, "channel_id", None) or getattr(peer, "chat_id", None)
+
+class OutboundScheduler:
+    def __init__(self):
+        self.global_bucket = TokenBucket(OUTBOUND_RATE, OUTBOUND_BURST)
+        self.chat_buckets = {}
+        self.flood_until = 0.0
+        self.chat_flood_until = {}
+
+    def _chat_bucket(self, chat):
+        bucket = self.chat_buckets.get(chat)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._prune()
+            bucket = self.chat_buckets[chat] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        self.chat_buckets = {c: b for c, b in self.chat_buckets.items() if b.delay(CHAT_BURST - 1) > 0}
+        self.chat_flood_until = {c: t for c, t in self.chat_flood_until.items() if t > now}
+
+    async def acquire(self, chat, priority: str):
+        start = time.monotonic()
+        floor = OUTBOUND_BULK_RESERVE if priority != "interactive" else 0
+        while True:
+            now = time.monotonic()
+            delay = max(self.flood_until, self.chat_flood_until.get(chat, 0)) - now
+            if delay > 0 and priority == "scheduled":
+                raise FloodWait(value=int(delay) + 1)
+            if delay <= 0:
+                bucket = self._chat_bucket(chat) if chat else None
+                delay = max(self.global_bucket.delay(floor), bucket.delay() if bucket else 0)
+                if delay <= 0:
+                    self.global_bucket.take()
+                    if bucket: bucket.take()
+                    OUTBOUND_WAIT.labels(priority).observe(now - start)
+                    return
+            await asyncio.sleep(delay)
+
+    def block(self, chat, seconds: int):
+        until = time.monotonic() + seconds
+        if chat:
+            self.chat_flood_until[chat] = max(self.chat_flood_until.get(chat, 0), until)
+        else:
+            self.flood_until = max(self.flood_until, until)
+
+    async def invoke(self, call, query, *args, **kwargs):
+        method = type(query).__name__
+        priority = outbound_priority.get()
+        chat = query_chat(query)
+        limited = method in RATE_LIMITED_METHODS
+        max_sleep = FLOOD_SLEEP_LIMITS[priority]
+        for attempt in range(3):
+            if limited:
+                await self.acquire(chat, priority)
+            try:
+                return await call(query, *args, **kwargs)
+            except FloodWait as e:
+                FLOOD_WAITS.labels(method, priority).inc()
+                if priority == "scheduled":
+                    # Later scheduled sends to this chat fail fast in acquire() until it clears.
+                    self.block(chat, e.value)
+                if e.value > max_sleep or attempt == 2:
+                    raise
+                logger.warning(f"⏳ FloodWait {e.value}s on {method} (chat {chat}, {priority})")
+                self.block(chat, e.value)
+                if not limited:
+                    await asyncio.sleep(e.value)
+
+outbound = OutboundScheduler()
+
+class ScheduledClient(Client):
+    """Pyrogram client whose API calls pass through the outbound scheduler."""
+
+    async def invoke(self, query, *args, **kwargs):
+        return await outbound.invoke(super().invoke, query, *args, **kwargs)
+
 # Initialize Pyrogram Client
-bot = Client(
+# sleep_threshold=0: every FloodWait reaches the scheduler instead of being slept on inside Pyrogram.
+bot = ScheduledClient(
     "UltimateMovieBot",
     api_id=API_ID,
     api_hash=API_HASH,
-    bot_token=BOT_TOKEN
+    bot_token=BOT_TOKEN,
+    workers=BOT_WORKERS,
+    sleep_threshold=0
 )
 
+def count_pending_tasks():
+    loop = getattr(bot, "loop", None)
+    return len(asyncio.all_tasks(loop)) if loop else 0
+
+ACTIVE_SESSIONS.set_function(lambda: len(user_conversations))
+PENDING_TASKS.set_function(count_pending_tasks)
+
 # ==============================================================================
-# FLASK KEEP-ALIVE SERVER
+# WEB SERVER (KEEP-ALIVE, HEALTH & METRICS) - SERVED FROM THE BOT'S EVENT LOOP
 # ==============================================================================
-app = Flask(__name__)
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "1.0"))
+HEALTH_MONGO_TIMEOUT = float(os.getenv("HEALTH_MONGO_TIMEOUT", "2.0"))
+LOOP_LAG = Gauge("bot_loop_lag_seconds", "Latest event loop lag sample")
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self.last_beat = time.monotonic()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.last_beat = time.monotonic()
+            LOOP_LAG.set(self.lag)
+
+    def current_lag(self):
+        # A monitor that has not woken up on time means the loop is stalled right now.
+        overdue = time.monotonic() - self.last_beat - self.interval
+        return max(self.lag, overdue)
+
+loop_monitor = LoopLagMonitor()
+web_routes = web.RouteTableDef()
+
+@web_routes.get('/')
+async def home(request):
+    code = request.query.get("code")
+    if code is not None:
+        return await resolve_redirect(code)
+    return web.Response(text="✅ Bot is Running Successfully!")
+
+async def resolve_redirect(code):
+    record = await get_delivery_record(code)
+    if record is None:
+        REDIRECTS.labels("invalid").inc()
+        return web.Response(
+            text="❌ Link Expired or Invalid.", status=404,
+            headers={"Cache-Control": "public, max-age=60"}
+        )
+    try:
+        bot_uname = await get_bot_username()
+    except Exception:
+        REDIRECTS.labels("unavailable").inc()
+        return web.Response(text="⏳ Bot is starting, try again.", status=503, headers={"Retry-After": "5"})
+
+    REDIRECTS.labels("ok").inc()
+    analytics.record(code, record.get("uploader_id"), "clicks")
+    return web.Response(
+        status=302,
+        headers={
+            "Location": f"https://t.me/{bot_uname}?start={code}",
+            "Cache-Control": f"public, max-age={REDIRECT_CACHE_TTL}",
+        }
+    )
+
+@web_routes.get('/metrics')
+async def metrics(request):
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
 
-@app.route('/')
-def home():
-    return "✅ Bot is Running Successfully!"
+@web_routes.get('/healthz')
+async def healthz(request):
+    lag = loop_monitor.current_lag()
+    mongo_ms, mongo_error = None, None
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(db_client.admin.command("ping"), HEALTH_MONGO_TIMEOUT)
+        mongo_ms = round((time.perf_counter() - start) * 1000, 1)
+    except Exception as e:
+        mongo_error = str(e) or type(e).__name__
 
-def run_flask():
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
+    healthy = lag < HEALTH_MAX_LOOP_LAG and mongo_error is None
+    return web.json_response(
+        {
+            "status": "ok" if healthy else "unhealthy",
+            "loop_lag_ms": round(lag * 1000, 1),
+            "mongo_ping_ms": mongo_ms,
+            "mongo_error": mongo_error,
+        },
+        status=200 if healthy else 503
+    )
 
-Thread(target=run_flask, daemon=True).start()
+async def start_web_server():
+    app = web.Application()
+    app.add_routes(web_routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", int(os.environ.get('PORT', 8080))).start()
+    return runner
 
 
 # ==============================================================================
@@ -127,6 +502,66 @@ async def get_bot_username():
         BOT_USERNAME = me.username
     return BOT_USERNAME
 
+class LRUCache:
+    """Bounded in-memory LRU with an optional per-entry TTL (seconds)."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._hits = CACHE_REQUESTS.labels(name, "hit")
+        self._misses = CACHE_REQUESTS.labels(name, "miss")
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self._hits.inc()
+                return value
+            del self._data[key]
+        self._misses.inc()
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight result."""
+
+    def __init__(self, name: str):
+        self.calls = {}
+        self._led = SINGLEFLIGHT_CALLS.labels(name, "led")
+        self._shared = SINGLEFLIGHT_CALLS.labels(name, "shared")
+
+    async def do(self, key, factory):
+        future = self.calls.get(key)
+        if future is not None:
+            self._shared.inc()
+        else:
+            self._led.inc()
+            future = self.calls[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda f: self.calls.pop(key, None) if self.calls.get(key) is f else None)
+        # A cancelled waiter must not cancel the call the others are waiting on.
+        return await asyncio.shield(future)
+
+tmdb_flight = SingleFlight("tmdb")
+shortener_flight = SingleFlight("shortener")
+
 def generate_random_code(length=8):
     chars = string.ascii_letters + string.digits
     return ''.join(secrets.choice(chars) for _ in range(length))
@@ -135,14 +570,157 @@ async def auto_delete_message(client, chat_id, message_id, delay_seconds):
     if delay_seconds > 0:
         await asyncio.sleep(delay_seconds)
         try:
-            await client.delete_messages(chat_id, message_id)
+            with bulk_traffic():
+                await client.delete_messages(chat_id, message_id)
         except Exception:
             pass
 
+def http_get(dependency: str, operation: str, url: str, timeout: int = 10):
+    """requests.get with latency/error metrics for the outbound dependency."""
+    with DEPENDENCY_LATENCY.labels(dependency, operation).time():
+        try:
+            response = requests.get(url, timeout=timeout)
+        except Exception:
+            DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+            raise
+    if response.status_code >= 400:
+        DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+    return response
+
+# --- File Code Lookup (Deep Links & Redirects) ---
+
+CODE_PATTERN = re.compile(r"^[A-Za-z0-9]{4,32}$")
+DELIVERY_PROJECTION = {"_id": 0, "file_id": 1, "log_msg_id": 1, "caption": 1, "delete_timer": 1, "uploader_id": 1}
+delivery_cache = LRUCache("deliveries", maxsize=DELIVERY_CACHE_SIZE, ttl=DELIVERY_CACHE_TTL)
+
+async def get_delivery_record(code: str):
+    if not CODE_PATTERN.match(code):
+        return None
+    record = delivery_cache.get(code)
+    if record is not None:
+        return record or None
+    record = await files_collection.find_one({"code": code}, DELIVERY_PROJECTION)
+    # Unknown codes are cached briefly (as {}) so a bad link can't hammer the database.
+    delivery_cache.set(code, record or {}, ttl=None if record else 60)
+    return record
+
+def get_file_media(msg):
+    if not msg:
+        return None
+    return msg.video or msg.document or msg.audio or msg.animation
+
+async def repair_file_id(code: str, file_data: dict, sent_msg):
+    """Store the fresh file_id from a log-channel copy so the next delivery is a cached send."""
+    media = get_file_media(sent_msg)
+    if not media or media.file_id == file_data.get("file_id"):
+        return
+    try:
+        await files_collection.update_one({"code": code}, {"$set": {"file_id": media.file_id}})
+        delivery_cache.set(code, {**file_data, "file_id": media.file_id})
+        FILE_ID_REPAIRS.labels("repaired").inc()
+    except Exception as e:
+        FILE_ID_REPAIRS.labels("failed").inc()
+        logger.error(f"File ID Repair Error ({code}): {e}")
+
+# --- Delivery Analytics ---
+# Deliveries (/start <code>) and redirect clicks (/?code=) are counted in
+# memory and flushed every ANALYTICS_FLUSH_INTERVAL as $inc upserts into
+# daily rollups: one document per (day, code) and per (day, uploader).
+
+class DeliveryAnalytics:
+    def __init__(self):
+        self.counts = {}
+        # (day, uploader_id) totals whose uploader rollup write has not landed yet.
+        self.uploader_counts = {}
+
+    def record(self, code: str, uploader_id, field: str):
+        key = (datetime.now().strftime("%Y-%m-%d"), code, uploader_id)
+        counters = self.counts.setdefault(key, {"deliveries": 0, "clicks": 0})
+        counters[field] += 1
+
+    def _merge(self, counts: dict):
+        for key, counters in counts.items():
+            current = self.counts.setdefault(key, {"deliveries": 0, "clicks": 0})
+            for field, value in counters.items():
+                current[field] += value
+
+    def _merge_uploader(self, day: str, uploader_id, counters: dict):
+        totals = self.uploader_counts.setdefault((day, uploader_id), {"deliveries": 0, "clicks": 0})
+        for field, value in counters.items():
+            totals[field] += value
+
+    async def flush(self):
+        if not self.counts and not self.uploader_counts:
+            return
+        batch, self.counts = self.counts, {}
+        keys, file_ops = list(batch), []
+        for day, code, uploader_id in keys:
+            inc = {field: value for field, value in batch[(day, code, uploader_id)].items() if value}
+            file_ops.append(UpdateOne(
+                {"_id": f"{day}:{code}"},
+                {"$inc": inc, "$setOnInsert": {"day": day, "code": code, "uploader_id": uploader_id}},
+                upsert=True
+            ))
+        failed = set()
+        try:
+            if file_ops:
+                await file_stats_collection.bulk_write(file_ops, ordered=False)
+        except asyncio.CancelledError:
+            # Shutdown cancelled the write; the final flush retries the whole batch.
+            self._merge(batch)
+            raise
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logger.error(f"Analytics Flush Error: {e}")
+            failed = set(range(len(keys)))
+        if failed:
+            # Only the writes that did not land are retried, so nothing is counted twice.
+            self._merge({keys[index]: batch[keys[index]] for index in failed})
+
+        # Uploader totals only include file counts that landed, plus any earlier
+        # uploader writes still pending.
+        for index, (day, code, uploader_id) in enumerate(keys):
+            if index not in failed and uploader_id is not None:
+                self._merge_uploader(day, uploader_id, batch[(day, code, uploader_id)])
+        if not self.uploader_counts:
+            return
+        uploader_batch, self.uploader_counts = self.uploader_counts, {}
+        uploader_keys = list(uploader_batch)
+        try:
+            await uploader_stats_collection.bulk_write([
+                UpdateOne(
+                    {"_id": f"{day}:{uploader_id}"},
+                    {"$inc": uploader_batch[(day, uploader_id)], "$setOnInsert": {"day": day, "uploader_id": uploader_id}},
+                    upsert=True
+                )
+                for day, uploader_id in uploader_keys
+            ], ordered=False)
+            failed = set()
+        except asyncio.CancelledError:
+            for day, uploader_id in uploader_keys:
+                self._merge_uploader(day, uploader_id, uploader_batch[(day, uploader_id)])
+            raise
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logger.error(f"Uploader Analytics Flush Error: {e}")
+            failed = set(range(len(uploader_keys)))
+        for index in failed:
+            self._merge_uploader(*uploader_keys[index], uploader_batch[uploader_keys[index]])
+
+analytics = DeliveryAnalytics()
+
+async def analytics_flush_loop():
+    while True:
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await analytics.flush()
+
+
 # --- Resource Downloaders ---
 
 def download_cascade():
-    cascade_file = "haarcascade_frontalface_default.xml"
+    cascade_file = CASCADE_FILE
     if not os.path.exists(cascade_file):
         url = "https://raw.githubusercontent.com/opencv/opencv/master/data/haarcascades/haarcascade_frontalface_default.xml"
         try:
@@ -154,7 +732,7 @@ def download_cascade():
     return cascade_file
 
 def download_font():
-    font_file = "HindSiliguri-Bold.ttf"
+    font_file = FONT_FILE
     if not os.path.exists(font_file):
         url = "https://github.com/google/fonts/raw/main/ofl/hindsiliguri/HindSiliguri-Bold.ttf"
         try:
@@ -167,15 +745,524 @@ def download_font():
 
 # --- Database Helpers ---
 
+# Users seen recently skip the upsert: their first_name / last_seen changes
+# are buffered and written in one bulk_write every USER_FLUSH_INTERVAL.
+seen_users = LRUCache("seen_users", maxsize=SEEN_USERS_SIZE, ttl=SEEN_USERS_TTL)
+pending_user_updates = {}
+
 async def add_user_to_db(user):
-    await users_collection.update_one(
+    if seen_users.get(user.id) is not None:
+        pending_user_updates[user.id] = {'first_name': user.first_name, 'last_seen': datetime.now()}
+        return
+    result = await users_collection.update_one(
         {'_id': user.id},
         {
-            '$set': {'first_name': user.first_name},
-            '$setOnInsert': {'is_premium': False, 'delete_timer': 0}
+            '$set': {'first_name': user.first_name, 'last_seen': datetime.now()},
+            '$setOnInsert': {'is_premium': False, 'delete_timer': 0, 'created_at': datetime.now()}
         },
         upsert=True
     )
+    seen_users.set(user.id, True)
+    if result.upserted_id is not None:
+        await bump_stats(users=1)
+
+async def flush_user_updates():
+    global pending_user_updates
+    if not pending_user_updates:
+        return
+    batch, pending_user_updates = pending_user_updates, {}
+    try:
+        await users_collection.bulk_write(
+            [UpdateOne({'_id': uid}, {'$set': fields}) for uid, fields in batch.items()], ordered=False
+        )
+    except asyncio.CancelledError:
+        for uid, fields in batch.items():
+            pending_user_updates.setdefault(uid, fields)
+        raise
+    except Exception as e:
+        logger.error(f"User Flush Error: {e}")
+        # Keep the failed batch unless newer values arrived meanwhile.
+        for uid, fields in batch.items():
+            pending_user_updates.setdefault(uid, fields)
+
+async def user_flush_loop():
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        await flush_user_updates()
+
+async def set_premium(user_id: int, is_premium: bool):
+    before = await users_collection.find_one_and_update(
+        {'_id': user_id},
+        {'$set': {'is_premium': is_premium}, '$setOnInsert': {'created_at': datetime.now()}},
+        projection={'is_premium': 1}, upsert=is_premium
+    )
+    if before is None:
+        if is_premium:
+            await bump_stats(users=1, premium=1)
+    elif before.get('is_premium', False) != is_premium:
+        await bump_stats(premium=1 if is_premium else -1)
+
+# --- Statistics Document ---
+# One document kept current with $inc on every insert / premium change and
+# periodically reconciled against real counts, so stats views cost one read.
+
+STATS_DOC_ID = "global"
+
+async def bump_stats(**deltas):
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    try:
+        await stats_collection.update_one({'_id': STATS_DOC_ID}, {'$inc': deltas}, upsert=True)
+    except Exception as e:
+        logger.error(f"Stats Update Error: {e}")
+
+async def reconcile_stats():
+    counts = {
+        "users": await users_collection.count_documents({}),
+        "premium": await users_collection.count_documents({'is_premium': True}),
+        "files": await files_collection.count_documents({}),
+        "requests": await requests_collection.count_documents({'status': {'$ne': 'fulfilled'}}),
+    }
+    await stats_collection.update_one(
+        {'_id': STATS_DOC_ID}, {'$set': {**counts, "reconciled_at": datetime.now()}}, upsert=True
+    )
+    return counts
+
+async def read_stats():
+    stats = await stats_collection.find_one({'_id': STATS_DOC_ID})
+    return stats or await reconcile_stats()
+
+async def stats_reconcile_loop():
+    while True:
+        try:
+            await reconcile_stats()
+        except Exception as e:
+            logger.error(f"Stats Reconcile Error: {e}")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+# --- Aggregated Request Log ---
+# One document per normalized title: repeat requests only bump `count`, add
+# the user to `requesters` and bump `new_count`, which the periodic digest to
+# LOG_CHANNEL_ID reports (ranked by demand) and then winds back down.
+
+def normalize_request_key(text: str) -> str:
+    return " ".join(re.sub(r'[^\w\s]', ' ', (text or "").lower()).split())
+
+async def log_request(uid: int, title: str, request_text: str):
+    key = normalize_request_key(title) or normalize_request_key(request_text)
+    update = {
+        '$addToSet': {'requesters': uid},
+        '$inc': {'count': 1, 'new_count': 1},
+        '$set': {'last_at': datetime.now(), 'last_request': request_text},
+        '$setOnInsert': {'title': title, 'status': 'pending', 'date': datetime.now()}
+    }
+    # A title asked for again after it was fulfilled is open demand again: the
+    # next upload must match it and notify the new requesters. Earlier requesters
+    # were already told about the last upload, so the list starts over.
+    reopened = await requests_collection.update_one(
+        {'key': key, 'status': 'fulfilled'},
+        {
+            '$inc': update['$inc'],
+            '$set': {**update['$set'], 'requesters': [uid], 'status': 'pending', 'reopened_at': datetime.now()}
+        }
+    )
+    if reopened.modified_count:
+        await bump_stats(requests=1)
+        return
+    try:
+        result = await requests_collection.update_one({'key': key}, update, upsert=True)
+    except DuplicateKeyError:
+        # Lost the insert race for a brand-new key; the other upsert created it.
+        result = await requests_collection.update_one({'key': key}, update)
+    if result.upserted_id is not None:
+        await bump_stats(requests=1)
+
+def format_request_digest(docs: list, remaining: int) -> str:
+    lines = [f"📨 **Request Digest** (last {max(1, REQUEST_DIGEST_INTERVAL // 60)} mins)\n"]
+    for rank, doc in enumerate(docs, 1):
+        lines.append(
+            f"{rank}. `{doc.get('title') or doc['key']}` — 🔥 {doc['new_count']} new · "
+            f"{doc.get('count', 0)} total · 👥 {len(doc.get('requesters', []))}"
+        )
+    if remaining:
+        lines.append(f"\n➕ {remaining} more titles requested.")
+    return "\n".join(lines)
+
+async def send_request_digest():
+    query = {'new_count': {'$gt': 0}}
+    docs = await requests_collection.find(
+        query, {'key': 1, 'title': 1, 'count': 1, 'new_count': 1, 'requesters': 1}
+    ).sort([('new_count', DESCENDING), ('count', DESCENDING)]).to_list(length=REQUEST_DIGEST_SIZE)
+    if not docs:
+        return
+    remaining = await requests_collection.count_documents(query) - len(docs)
+    with bulk_traffic():
+        await bot.send_message(LOG_CHANNEL_ID, format_request_digest(docs, remaining))
+    # Subtract what was reported; requests that arrived meanwhile stay for the next digest.
+    await requests_collection.bulk_write(
+        [UpdateOne({'_id': doc['_id']}, {'$inc': {'new_count': -doc['new_count']}}) for doc in docs],
+        ordered=False
+    )
+
+async def request_digest_loop():
+    while True:
+        await asyncio.sleep(REQUEST_DIGEST_INTERVAL)
+        if not LOG_CHANNEL_ID:
+            continue
+        try:
+            await send_request_digest()
+        except Exception as e:
+            logger.error(f"Request Digest Error: {e}")
+
+# --- Request Fulfillment ---
+# A new upload closes the pending request with the same normalized title via
+# a point lookup on the unique `key` index. Requesters are told in batches by
+# a background notifier that reads the partial `notify_pending` index.
+FULFILL_NOTIFY_BATCH = 100
+FULFILL_NOTIFY_INTERVAL = 10
+
+def session_title(convo: dict) -> str:
+    details = convo.get('details') or {}
+    return details.get('title') or details.get('name') or ""
+
+def parse_post_title(caption: str) -> str:
+    """'🎬 Title (2023)' (first caption line of a channel post) -> 'Title'."""
+    first_line = (caption or "").strip().split("\n")[0]
+    first_line = re.sub(r'^[^\w]+', '', first_line)
+    return re.sub(r'\s*\((\d{4}|-{4})\)\s*$', '', first_line).strip()
+
+async def fulfill_requests(title: str, code: str, link: str, convo: dict = None):
+    key = normalize_request_key(title)
+    if not key:
+        return
+    if convo is not None:
+        # Every episode of a batch has the same title; look it up once per session.
+        checked = convo.setdefault("fulfill_checked", set())
+        if key in checked:
+            return
+        checked.add(key)
+    try:
+        closed = await requests_collection.find_one_and_update(
+            {'key': key, 'status': 'pending'},
+            {'$set': {'status': 'fulfilled', 'fulfilled_at': datetime.now(), 'file_code': code,
+                      'link': link, 'notify_pending': True}},
+            projection={'_id': 1}
+        )
+        if closed:
+            await bump_stats(requests=-1)
+            logger.info(f"✅ Request fulfilled by upload: {title}")
+    except Exception as e:
+        logger.error(f"Request Fulfillment Error: {e}")
+
+async def notify_fulfilled_requests():
+    docs = await requests_collection.find(
+        {'notify_pending': True}, {'title': 1, 'link': 1, 'requesters': 1}
+    ).to_list(length=FULFILL_NOTIFY_BATCH)
+    if not docs:
+        return
+    by_user, waiting = {}, {}
+    for doc in docs:
+        requesters = set(doc.get('requesters') or [])
+        if not doc.get('title') or not doc.get('link'):
+            logger.warning(f"Skipping malformed fulfilled request {doc['_id']}")
+            requesters = set()
+        for uid in requesters:
+            by_user.setdefault(uid, []).append(doc)
+        waiting[doc['_id']] = len(requesters)
+
+    nobody = [doc_id for doc_id, count in waiting.items() if not count]
+    if nobody:
+        await requests_collection.update_many({'_id': {'$in': nobody}}, {'$unset': {'notify_pending': ""}})
+
+    # One message per user, however many of their requests were fulfilled. A
+    # request is cleared as soon as all of its requesters have been handled, so
+    # a failure part-way never re-sends to users who were already reached.
+    with bulk_traffic():
+        for uid, fulfilled in by_user.items():
+            try:
+                names = "\n".join([f"🎬 **{doc['title']}**" for doc in fulfilled])
+                buttons = [[InlineKeyboardButton(f"📥 {doc['title'][:40]}", url=doc['link'])] for doc in fulfilled]
+                await bot.send_message(
+                    uid, f"🎉 **আপনার রিকোয়েস্ট করা মুভি এখন আপলোড হয়েছে!**\n\n{names}",
+                    reply_markup=InlineKeyboardMarkup(buttons)
+                )
+            except Exception:
+                pass
+            for doc in fulfilled:
+                waiting[doc['_id']] -= 1
+                if not waiting[doc['_id']]:
+                    await requests_collection.update_one({'_id': doc['_id']}, {'$unset': {'notify_pending': ""}})
+            await asyncio.sleep(1 / FULFILL_NOTIFY_RATE)
+
+async def request_notify_loop():
+    while True:
+        try:
+            await notify_fulfilled_requests()
+        except Exception as e:
+            logger.error(f"Request Notify Error: {e}")
+        await asyncio.sleep(FULFILL_NOTIFY_INTERVAL)
+
+# --- Streaming Database Backup ---
+# Collections are read in batched cursors and written as gzip NDJSON parts
+# ({"c": collection, "d": document} per line, MongoDB extended JSON).
+
+BACKUP_BATCH_SIZE = 1000
+BACKUP_PART_MARGIN = 4 * 1024 * 1024
+# Collection -> field that only grows for new documents (incremental checkpoint)
+BACKUP_SOURCES = {"users": "created_at", "files": "_id", "requests": "_id"}
+
+class BackupWriter:
+    """Writes gzip NDJSON parts, starting a new part before one outgrows max_bytes."""
+
+    def __init__(self, directory: str, prefix: str, max_bytes: int, meta: dict):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.meta = meta
+        self.paths = []
+        self._raw = None
+        self._gz = None
+
+    def _rotate(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.prefix}_part{len(self.paths) + 1:03d}.ndjson.gz")
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self.paths.append(path)
+        header = {"_backup": {**self.meta, "part": len(self.paths)}}
+        self._gz.write((json_util.dumps(header) + "\n").encode("utf-8"))
+
+    def write(self, collection: str, docs: list):
+        for doc in docs:
+            # The compressed size lags what zlib still buffers, hence the margin.
+            if self._gz is None or self._raw.tell() + BACKUP_PART_MARGIN >= self.max_bytes:
+                self._rotate()
+            line = json_util.dumps({"c": collection, "d": doc}, json_options=json_util.RELAXED_JSON_OPTIONS)
+            self._gz.write((line + "\n").encode("utf-8"))
+
+    def close(self):
+        if self._gz:
+            self._gz.close()
+            self._raw.close()
+            self._gz = self._raw = None
+
+async def run_backup(directory: str, incremental: bool, progress=None):
+    checkpoint = await backups_collection.find_one({'_id': 'checkpoint'}) if incremental else None
+    kind = "incremental" if checkpoint else "full"
+    prefix = f"backup_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    writer = BackupWriter(directory, prefix, BACKUP_PART_SIZE, {"version": 1, "kind": kind, "created_at": datetime.now()})
+
+    counts, new_checkpoint = {}, {}
+    try:
+        for name, field in BACKUP_SOURCES.items():
+            query = {}
+            if checkpoint and checkpoint.get(name) is not None:
+                query = {field: {'$gt': checkpoint[name]}}
+            cursor = db[name].find(query).sort(field, ASCENDING).batch_size(BACKUP_BATCH_SIZE)
+
+            batch, count, last = [], 0, None
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= BACKUP_BATCH_SIZE:
+                    last = batch[-1].get(field, last)
+                    await asyncio.to_thread(writer.write, name, batch)
+                    count += len(batch)
+                    batch = []
+                    if progress:
+                        await progress(name, count)
+            if batch:
+                last = batch[-1].get(field, last)
+                await asyncio.to_thread(writer.write, name, batch)
+                count += len(batch)
+
+            counts[name] = count
+            new_checkpoint[name] = last if last is not None else (checkpoint or {}).get(name)
+    finally:
+        await asyncio.to_thread(writer.close)
+
+    return kind, writer.paths, counts, new_checkpoint
+
+# --- Streaming Database Restore ---
+# Accepts the gzip NDJSON parts written above (or plain NDJSON) and the old
+# json.dump backup ({"users": [...], "files": [...]}), decoded incrementally.
+
+RESTORE_BATCH_SIZE = 1000
+RESTORE_COLLECTIONS = ("users", "files", "requests")
+
+class LegacyJSONStream:
+    """Incremental reader for the legacy backup: one list element at a time."""
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._more()
+
+    def take(self, expected):
+        ch = self.peek()
+        if not ch or ch not in expected:
+            raise ValueError(f"Unexpected {ch!r} in legacy backup (expected {expected!r})")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
+
+def revive_legacy_doc(doc):
+    # The old backup stringified ObjectIds and datetimes (json.dump default=str).
+    _id = doc.get("_id")
+    if isinstance(_id, str) and ObjectId.is_valid(_id):
+        doc["_id"] = ObjectId(_id)
+    for field in ("created_at", "date"):
+        if isinstance(doc.get(field), str):
+            try: doc[field] = datetime.fromisoformat(doc[field])
+            except ValueError: pass
+    return doc
+
+def iter_legacy_backup(path):
+    with open(path, "r", encoding="utf-8") as f:
+        stream = LegacyJSONStream(f)
+        stream.take("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            collection = stream.value()
+            stream.take(":")
+            stream.take("[")
+            if stream.peek() == "]":
+                stream.take("]")
+            else:
+                while True:
+                    yield collection, revive_legacy_doc(stream.value())
+                    if stream.take(",]") == "]":
+                        break
+            if stream.take(",}") == "}":
+                return
+
+def iter_ndjson_backup(f):
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        entry = json_util.loads(line)
+        if "_backup" in entry:
+            continue
+        yield entry["c"], entry["d"]
+
+def iter_backup_docs(path):
+    with open(path, "rb") as raw:
+        magic = raw.read(2)
+        raw.seek(0)
+        first_line = raw.readline(4096).strip()
+
+    if magic == b"\x1f\x8b":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield from iter_ndjson_backup(f)
+    elif first_line.startswith(b'{"c"') or first_line.startswith(b'{"_backup"'):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from iter_ndjson_backup(f)
+    else:
+        yield from iter_legacy_backup(path)
+
+async def restore_backup_file(path: str, progress=None):
+    docs = iter_backup_docs(path)
+    counts, errors = {}, 0
+    while True:
+        batch = await asyncio.to_thread(list, itertools.islice(docs, RESTORE_BATCH_SIZE))
+        if not batch:
+            break
+
+        grouped = {}
+        for collection, doc in batch:
+            if collection in RESTORE_COLLECTIONS:
+                grouped.setdefault(collection, []).append(
+                    ReplaceOne({'_id': doc['_id']}, doc, upsert=True) if '_id' in doc else InsertOne(doc)
+                )
+        for collection, ops in grouped.items():
+            try:
+                await db[collection].bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                errors += len(e.details.get("writeErrors", []))
+            counts[collection] = counts.get(collection, 0) + len(ops)
+
+        if progress:
+            await progress(counts)
+    return counts, errors
+
+# Every index the bot's queries rely on, per collection. Ensured at startup.
+# Default names are kept so indexes created by hand earlier are recognised.
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("is_premium", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    "files": [
+        IndexModel([("code", ASCENDING)], unique=True),
+        IndexModel(
+            [("file_unique_id", ASCENDING)], unique=True,
+            partialFilterExpression={"file_unique_id": {"$exists": True}}
+        ),
+        IndexModel([("uploader_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "requests": [
+        IndexModel(
+            [("key", ASCENDING)], unique=True,
+            partialFilterExpression={"key": {"$exists": True}}
+        ),
+        IndexModel([("new_count", DESCENDING), ("count", DESCENDING)]),
+        IndexModel([("notify_pending", ASCENDING)], partialFilterExpression={"notify_pending": True}),
+    ],
+    "file_stats_daily": [
+        IndexModel([("day", ASCENDING), ("deliveries", DESCENDING)]),
+        IndexModel([("uploader_id", ASCENDING), ("day", ASCENDING)]),
+    ],
+    "uploader_stats_daily": [
+        IndexModel([("uploader_id", ASCENDING), ("day", ASCENDING)]),
+    ],
+    "scheduled_posts": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)]),
+        IndexModel([("channel_id", ASCENDING), ("run_at", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("run_at", ASCENDING)]),
+    ],
+}
+
+async def ensure_indexes():
+    for collection_name, indexes in INDEX_SPECS.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except Exception as e:
+                logger.error(f"Index Error ({collection_name}.{index.document['name']}): {e}")
+    logger.info("🗂 Database indexes ensured.")
 
 async def is_user_premium(user_id: int) -> bool:
     if user_id == OWNER_ID:
@@ -186,6 +1273,10 @@ async def is_user_premium(user_id: int) -> bool:
     return False
 
 async def shorten_link(user_id: int, long_url: str):
+    # Many users searching the same title shorten the same codes at once.
+    return await shortener_flight.do((user_id, long_url), lambda: request_short_link(user_id, long_url))
+
+async def request_short_link(user_id: int, long_url: str):
     user_data = await users_collection.find_one({'_id': user_id})
     
     if not user_data or 'shortener_api' not in user_data or 'shortener_url' not in user_data:
@@ -196,7 +1287,7 @@ async def shorten_link(user_id: int, long_url: str):
     api_url = f"https://{base_url}/api?api={api_key}&url={long_url}"
     
     try:
-        response = requests.get(api_url, timeout=10)
+        response = await asyncio.to_thread(http_get, "shortener", "shorten", api_url, 10)
         data = response.json()
         if data.get("status") == "success" and data.get("shortenedUrl"):
             return data["shortenedUrl"]
@@ -209,6 +1300,104 @@ async def shorten_link(user_id: int, long_url: str):
 # 3. DECORATORS
 # ==============================================================================
 
+MEDIA_KINDS = ("video", "document", "audio", "animation", "photo")
+
+def carries_media(update) -> bool:
+    return bool(getattr(update, "media_group_id", None) or any(getattr(update, kind, None) for kind in MEDIA_KINDS))
+
+class UserDispatcher:
+    """Runs each user's updates one at a time in arrival order; different users run in parallel."""
+
+    def __init__(self):
+        self.queues = {}
+        self.workers = {}
+        self.jobs = set()
+        self.shed_noticed = set()
+
+    def submit(self, uid: int, func, client, update):
+        queue = self.queues.setdefault(uid, deque())
+        # Files are never shed: a forwarded season or album arrives as one burst.
+        if len(queue) >= USER_QUEUE_SIZE and not carries_media(update):
+            USER_QUEUE_DROPS.inc()
+            logger.warning(f"⚠️ Dropping update from {uid}: {len(queue)} already queued")
+            self._notify_shed(uid, update)
+            return None
+        done = asyncio.get_running_loop().create_future()
+        # Errors are logged here; only callers that await the future (the harness) see them.
+        done.add_done_callback(lambda f: f.cancelled() or f.exception())
+        queue.append((func, client, update, done))
+        if uid not in self.workers:
+            self.workers[uid] = asyncio.create_task(self._run(uid, queue))
+        return done
+
+    async def _run(self, uid: int, queue: deque):
+        try:
+            while queue:
+                func, client, update, done = queue.popleft()
+                try:
+                    await func(client, update)
+                    done.set_result(None)
+                except Exception as e:
+                    logger.exception(f"Handler error for user {uid}: {e}")
+                    done.set_exception(e)
+        finally:
+            self.workers.pop(uid, None)
+            self.queues.pop(uid, None)
+            self.shed_noticed.discard(uid)
+
+    def _notify_shed(self, uid: int, update):
+        if isinstance(update, CallbackQuery):
+            self.spawn(update.answer("⏳ Still working on your previous actions, try again in a moment."))
+        elif uid not in self.shed_noticed:
+            # One notice per burst; reset once the user's queue drains.
+            self.shed_noticed.add(uid)
+            self.spawn(update.reply_text("⚠️ **Too many messages at once.** Some were skipped, please send them again."))
+
+    def spawn(self, coro):
+        """Run a long job (broadcast, backup, restore) outside the user's queue."""
+        task = asyncio.create_task(coro)
+        self.jobs.add(task)
+        task.add_done_callback(self._job_done)
+        return task
+
+    def _job_done(self, task):
+        self.jobs.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Background job failed: {task.exception()}")
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def wait_idle(self):
+        while self.workers or self.jobs:
+            await asyncio.gather(*list(self.workers.values()), *list(self.jobs), return_exceptions=True)
+
+dispatcher = UserDispatcher()
+USER_QUEUE_DEPTH.set_function(dispatcher.depth)
+
+def serialized(func):
+    """Hand the update to the sender's queue and free the Pyrogram worker right away."""
+    async def wrapper(client, update):
+        user = getattr(update, "from_user", None)
+        if not user:
+            return await func(client, update)
+        return dispatcher.submit(user.id, func, client, update)
+    return wrapper
+
+def track_handler(name):
+    def decorator(func):
+        async def wrapper(client, update):
+            start = time.perf_counter()
+            try:
+                await func(client, update)
+            except Exception:
+                HANDLER_ERRORS.labels(name).inc()
+                raise
+            finally:
+                HANDLER_LATENCY.labels(name).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
 def force_subscribe(func):
     async def wrapper(client, message):
         if FORCE_SUB_CHANNEL:
@@ -251,7 +1440,7 @@ def watermark_poster(poster_input, watermark_text: str, badge_text: str = None):
         original_img = None
         if isinstance(poster_input, str):
             if poster_input.startswith("http"): 
-                img_data = requests.get(poster_input, timeout=15).content
+                img_data = http_get("tmdb", "poster", poster_input, timeout=15).content
                 original_img = Image.open(io.BytesIO(img_data)).convert("RGBA")
             else: 
                 if os.path.exists(poster_input):
@@ -264,6 +1453,7 @@ def watermark_poster(poster_input, watermark_text: str, badge_text: str = None):
         if not original_img:
             return None, "Failed to load image."
         
+        render_start = time.perf_counter()
         img = Image.new("RGBA", original_img.size)
         img.paste(original_img)
         draw = ImageDraw.Draw(img)
@@ -358,6 +1548,7 @@ def watermark_poster(poster_input, watermark_text: str, badge_text: str = None):
         buffer.name = "poster.png"
         img.convert("RGB").save(buffer, "PNG")
         buffer.seek(0)
+        RENDER_LATENCY.observe(time.perf_counter() - render_start)
         return buffer, None
 
     except Exception as e:
@@ -369,7 +1560,7 @@ def watermark_poster(poster_input, watermark_text: str, badge_text: str = None):
 def get_tmdb_trailer(media_type, media_id):
     url = f"https://api.themoviedb.org/3/{media_type}/{media_id}/videos?api_key={TMDB_API_KEY}"
     try:
-        r = requests.get(url, timeout=10)
+        r = http_get("tmdb", "trailer", url, timeout=10)
         r.raise_for_status()
         data = r.json()
         for vid in data.get("results", []):
@@ -382,7 +1573,7 @@ def get_tmdb_trailer(media_type, media_id):
 def get_trending_today():
     url = f"https://api.themoviedb.org/3/trending/all/day?api_key={TMDB_API_KEY}"
     try:
-        r = requests.get(url, timeout=10)
+        r = http_get("tmdb", "trending", url, timeout=10)
         r.raise_for_status()
         return r.json().get("results", [])[:10]
     except Exception:
@@ -391,7 +1582,7 @@ def get_trending_today():
 def search_tmdb(query: str):
     url = f"https://api.themoviedb.org/3/search/multi?api_key={TMDB_API_KEY}&query={query}&include_adult=true&page=1"
     try:
-        r = requests.get(url, timeout=10)
+        r = http_get("tmdb", "search", url, timeout=10)
         r.raise_for_status()
         data = r.json()
         results = data.get("results", [])
@@ -402,7 +1593,7 @@ def search_tmdb(query: str):
 def search_by_imdb(imdb_id: str):
     url = f"https://api.themoviedb.org/3/find/{imdb_id}?api_key={TMDB_API_KEY}&external_source=imdb_id"
     try:
-        r = requests.get(url, timeout=10)
+        r = http_get("tmdb", "find", url, timeout=10)
         r.raise_for_status()
         data = r.json()
         results = []
@@ -419,7 +1610,7 @@ def search_by_imdb(imdb_id: str):
 def get_tmdb_details(media_type, media_id):
     url = f"https://api.themoviedb.org/3/{media_type}/{media_id}?api_key={TMDB_API_KEY}"
     try:
-        r = requests.get(url, timeout=10)
+        r = http_get("tmdb", "details", url, timeout=10)
         r.raise_for_status()
         data = r.json()
         data['media_type'] = media_type 
@@ -427,6 +1618,94 @@ def get_tmdb_details(media_type, media_id):
     except Exception:
         return None
 
+def download_poster(poster_path: str):
+    try:
+        r = http_get("tmdb", "poster", f"https://image.tmdb.org/t/p/w500{poster_path}", timeout=15)
+        r.raise_for_status()
+        return r.content or None
+    except Exception:
+        return None
+
+# --- Cached TMDB Lookups & Trending Warmer ---
+# The warmer refreshes today's trending list and prefetches details, trailer
+# and poster bytes for the top items, so /trending -> sel_ -> proc_final is
+# served from memory. Misses fall through to a live (threaded) request.
+NO_TRAILER = ""
+
+trending_cache = LRUCache("tmdb_trending", maxsize=1, ttl=TRENDING_REFRESH_INTERVAL * 3)
+details_cache = LRUCache("tmdb_details", maxsize=2000, ttl=TMDB_CACHE_TTL)
+trailer_cache = LRUCache("tmdb_trailer", maxsize=2000, ttl=TMDB_CACHE_TTL)
+poster_cache = LRUCache("tmdb_poster", maxsize=POSTER_CACHE_SIZE, ttl=TMDB_CACHE_TTL)
+
+async def get_trending_cached():
+    results = trending_cache.get("today")
+    if results is None:
+        results = await asyncio.to_thread(get_trending_today)
+        if results:
+            trending_cache.set("today", results)
+    return results
+
+async def get_details_cached(media_type, media_id):
+    key = (media_type, str(media_id))
+    details = details_cache.get(key)
+    if details is None:
+        details = await tmdb_flight.do(
+            ("details",) + key, lambda: asyncio.to_thread(get_tmdb_details, media_type, media_id)
+        )
+        if not details:
+            return None
+        details_cache.set(key, details)
+    # Sessions keep their own copy; the cached one is shared.
+    return dict(details)
+
+async def get_trailer_cached(media_type, media_id):
+    key = (media_type, str(media_id))
+    trailer = trailer_cache.get(key)
+    if trailer is None:
+        trailer = await tmdb_flight.do(
+            ("trailer",) + key, lambda: asyncio.to_thread(get_tmdb_trailer, media_type, media_id)
+        ) or NO_TRAILER
+        # "No trailer" may just be a failed request, so it is rechecked sooner.
+        trailer_cache.set(key, trailer, ttl=None if trailer else 3600)
+    return trailer or None
+
+async def get_poster_cached(poster_path: str):
+    data = poster_cache.get(poster_path)
+    if data is None:
+        data = await tmdb_flight.do(("poster", poster_path), lambda: asyncio.to_thread(download_poster, poster_path))
+        if data:
+            poster_cache.set(poster_path, data)
+    return data
+
+async def search_tmdb_shared(query: str):
+    key = " ".join(query.lower().split())
+    return await tmdb_flight.do(("search", key), lambda: asyncio.to_thread(search_tmdb, query))
+
+async def search_by_imdb_shared(imdb_id: str):
+    return await tmdb_flight.do(("find", imdb_id), lambda: asyncio.to_thread(search_by_imdb, imdb_id))
+
+async def warm_trending():
+    results = await asyncio.to_thread(get_trending_today)
+    if not results:
+        return
+    trending_cache.set("today", results)
+    for item in results[:TRENDING_PREFETCH]:
+        m_type = item.get('media_type', 'movie')
+        if m_type not in ("movie", "tv"):
+            continue
+        details = await get_details_cached(m_type, item['id'])
+        await get_trailer_cached(m_type, item['id'])
+        if details and details.get('poster_path'):
+            await get_poster_cached(details['poster_path'])
+
+async def trending_warmer_loop():
+    while True:
+        try:
+            await warm_trending()
+        except Exception as e:
+            logger.error(f"Trending Warmer Error: {e}")
+        await asyncio.sleep(TRENDING_REFRESH_INTERVAL)
+
 def extract_id_from_url(url: str):
     tmdb_pattern = r"themoviedb\.org/(movie|tv)/(\d+)"
     tmdb_match = re.search(tmdb_pattern, url)
@@ -485,15 +1764,18 @@ https://t.me/+GL_XAS4MsJg4ODM1"""
 # ==============================================================================
 
 @bot.on_message(filters.command("cancel") & filters.private)
+@serialized
+@track_handler("cancel_process_cmd")
 async def cancel_process_cmd(client, message: Message):
     uid = message.from_user.id
-    if uid in user_conversations:
-        del user_conversations[uid]
+    if drop_session(uid) is not None:
         await message.reply_text("✅ **All processes have been cancelled successfully.**")
     else:
         await message.reply_text("ℹ️ **No active process found to cancel.**")
 
 @bot.on_message(filters.command("settings") & filters.private)
+@serialized
+@track_handler("settings_dashboard")
 @force_subscribe
 async def settings_dashboard(client, message: Message):
     uid = message.from_user.id
@@ -517,53 +1799,146 @@ async def settings_dashboard(client, message: Message):
             f"• `/setdomain url.com`\n"
             f"• `/setapi Key`\n"
             f"• `/settimer 10` (in mins)\n"
-            f"• `/addchannel -100xxx`")
+            f"• `/addchannel -100xxx`\n"
+            f"• `/mystats 7` (downloads, last N days)")
     
     await message.reply_text(text)
 
 @bot.on_message(filters.command("backup") & filters.private)
+@serialized
+@track_handler("backup_db_cmd")
 async def backup_db_cmd(client, message: Message):
     if message.from_user.id != OWNER_ID:
         return
+    incremental = len(message.command) > 1 and message.command[1].lower() in ("inc", "incremental")
     msg = await message.reply_text("🔄 **Generating Database Backup...**")
+    # Runs as a job so the owner's other commands aren't queued behind it.
+    dispatcher.spawn(run_backup_job(message, msg, incremental))
+
+async def run_backup_job(message: Message, msg: Message, incremental: bool):
+    directory = tempfile.mkdtemp(prefix="backup_")
+    last_edit = 0
+
+    async def progress(collection, count):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < 3:
+            return
+        last_edit = time.monotonic()
+        try: await msg.edit_text(f"🔄 **Backing up `{collection}`...**\n📄 {count} documents written")
+        except Exception: pass
+
     try:
-        users = await users_collection.find({}).to_list(None)
-        files = await files_collection.find({}).to_list(None)
-        
-        backup_data = {"users": users, "files": files}
-        
-        with open("db_backup.json", "w", encoding="utf-8") as f:
-            json.dump(backup_data, f, default=str, indent=4)
-            
-        await message.reply_document("db_backup.json", caption="📦 **Database Backup Successfully Generated.**")
-        os.remove("db_backup.json")
-        await msg.delete()
+        kind, paths, counts, checkpoint = await run_backup(directory, incremental, progress)
+        summary = "\n".join([f"• `{name}`: {count}" for name, count in counts.items()])
+
+        if kind == "incremental" and not any(counts.values()):
+            return await msg.edit_text("ℹ️ **Nothing new since the last backup.**")
+
+        for i, path in enumerate(paths, 1):
+            await message.reply_document(path, caption=f"📦 **Database Backup ({kind})**\nPart {i}/{len(paths)}")
+
+        await backups_collection.update_one(
+            {'_id': 'checkpoint'}, {'$set': {**checkpoint, 'at': datetime.now()}}, upsert=True
+        )
+        await msg.edit_text(f"✅ **{kind.title()} Backup Complete!**\n\n{summary}\n\n💡 `/backup inc` exports only documents added since the last backup; changes to existing ones (premium, settings, request counts) need a full `/backup`.")
     except Exception as e:
+        logger.error(f"Backup Error: {e}")
         await msg.edit_text(f"❌ **Backup Failed:** {str(e)}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
 
 # --- ADMIN DIRECT COMMANDS ---
 @bot.on_message(filters.command("stats") & filters.private)
+@serialized
+@track_handler("stats_command")
 async def stats_command(client, message: Message):
     if message.from_user.id != OWNER_ID: return
-    total = await users_collection.count_documents({})
-    prem = await users_collection.count_documents({'is_premium': True})
-    files = await files_collection.count_documents({})
-    reqs = await requests_collection.count_documents({})
-    await message.reply_text(f"📊 **Bot Statistics:**\n\n👥 Total Users: {total}\n💎 Premium Users: {prem}\n📂 Total Files: {files}\n📨 Pending Requests: {reqs}")
+    stats = await read_stats()
+    await message.reply_text(f"📊 **Bot Statistics:**\n\n👥 Total Users: {stats.get('users', 0)}\n💎 Premium Users: {stats.get('premium', 0)}\n📂 Total Files: {stats.get('files', 0)}\n📨 Pending Requests: {stats.get('requests', 0)}")
+
+# --- Download Analytics Views (daily rollups) ---
+ANALYTICS_TOP_N = 10
+
+def analytics_days(message: Message, default: int = 7) -> int:
+    try:
+        return max(1, min(90, int(message.command[1])))
+    except (IndexError, ValueError):
+        return default
+
+def analytics_since(days: int) -> str:
+    return (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+async def top_files(match: dict, limit: int = ANALYTICS_TOP_N) -> list:
+    rows = await file_stats_collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$code", "deliveries": {"$sum": "$deliveries"}, "clicks": {"$sum": "$clicks"}}},
+        {"$sort": {"deliveries": -1, "clicks": -1}},
+        {"$limit": limit},
+    ]).to_list(length=limit)
+    captions = {
+        f["code"]: f.get("caption", "")
+        async for f in files_collection.find({"code": {"$in": [r["_id"] for r in rows]}}, {"code": 1, "caption": 1})
+    }
+    for row in rows:
+        first_line = (captions.get(row["_id"]) or "").split("\n")[0]
+        row["name"] = first_line.replace("*", "").replace("🎬", "").strip() or row["_id"]
+    return rows
+
+def format_top_files(rows: list) -> str:
+    return "\n".join([
+        f"{rank}. {row['name'][:40]} — 📥 {row['deliveries']} · 🔗 {row['clicks']}"
+        for rank, row in enumerate(rows, 1)
+    ])
+
+@bot.on_message(filters.command("topfiles") & filters.private)
+@serialized
+@track_handler("top_files_cmd")
+async def top_files_cmd(client, message: Message):
+    if message.from_user.id != OWNER_ID: return
+    days = analytics_days(message)
+    rows = await top_files({"day": {"$gte": analytics_since(days)}})
+    if not rows:
+        return await message.reply_text(f"📭 **No downloads in the last {days} days.**")
+    await message.reply_text(f"🏆 **Top Files (last {days} days):**\n\n" + format_top_files(rows))
+
+@bot.on_message(filters.command("mystats") & filters.private)
+@serialized
+@track_handler("my_stats_cmd")
+async def my_stats_cmd(client, message: Message):
+    uid = message.from_user.id
+    days = analytics_days(message)
+    since = analytics_since(days)
+    totals = await uploader_stats_collection.aggregate([
+        {"$match": {"uploader_id": uid, "day": {"$gte": since}}},
+        {"$group": {"_id": None, "deliveries": {"$sum": "$deliveries"}, "clicks": {"$sum": "$clicks"}}},
+    ]).to_list(length=1)
+    if not totals:
+        return await message.reply_text(f"📭 **No downloads of your files in the last {days} days.**")
+    rows = await top_files({"uploader_id": uid, "day": {"$gte": since}})
+    await message.reply_text(
+        f"📈 **Your Files (last {days} days):**\n\n"
+        f"📥 Downloads: {totals[0].get('deliveries', 0)}\n"
+        f"🔗 Link Clicks: {totals[0].get('clicks', 0)}\n\n"
+        f"🏆 **Top Files:**\n" + format_top_files(rows)
+    )
 
 @bot.on_message(filters.command("broadcast") & filters.private)
+@serialized
+@track_handler("broadcast_command")
 async def broadcast_command(client, message: Message):
     if message.from_user.id != OWNER_ID: return
     user_conversations[message.from_user.id] = {"state": "admin_broadcast_wait"}
     await message.reply_text("📢 **Broadcast Mode**\n\nSend the message (Text/Photo/Video) you want to broadcast.\n(Type /cancel to stop)")
 
 @bot.on_message(filters.command("addpremium") & filters.private)
+@serialized
+@track_handler("add_premium_cmd")
 async def add_premium_cmd(client, message: Message):
     if message.from_user.id != OWNER_ID: return
     if len(message.command) > 1:
         try:
             user_id = int(message.command[1])
-            await users_collection.update_one({'_id': user_id}, {'$set': {'is_premium': True}}, upsert=True)
+            await set_premium(user_id, True)
             await message.reply_text(f"✅ Premium Added to ID: `{user_id}`")
         except:
             await message.reply_text("❌ Invalid ID format.")
@@ -572,12 +1947,14 @@ async def add_premium_cmd(client, message: Message):
         await message.reply_text("➕ **Add Premium**\n\nSend User ID.\n(Type /cancel to stop)")
 
 @bot.on_message(filters.command("rempremium") & filters.private)
+@serialized
+@track_handler("rem_premium_cmd")
 async def rem_premium_cmd(client, message: Message):
     if message.from_user.id != OWNER_ID: return
     if len(message.command) > 1:
         try:
             user_id = int(message.command[1])
-            await users_collection.update_one({'_id': user_id}, {'$set': {'is_premium': False}})
+            await set_premium(user_id, False)
             await message.reply_text(f"✅ Premium Removed from ID: `{user_id}`")
         except:
             await message.reply_text("❌ Invalid ID format.")
@@ -585,11 +1962,26 @@ async def rem_premium_cmd(client, message: Message):
         user_conversations[message.from_user.id] = {"state": "admin_rem_prem_wait"}
         await message.reply_text("➖ **Remove Premium**\n\nSend User ID.\n(Type /cancel to stop)")
 
+@bot.on_message(filters.command("restore") & filters.private)
+@serialized
+@track_handler("restore_cmd")
+async def restore_cmd(client, message: Message):
+    if message.from_user.id != OWNER_ID: return
+    user_conversations[message.from_user.id] = {"state": "admin_restore_wait", "restored": {}}
+    await message.reply_text(
+        "♻️ **Restore Mode**\n\n"
+        "Send backup files one by one (`.ndjson.gz` parts or the old `db_backup.json`).\n"
+        "Documents are upserted, so sending a part twice is safe.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ Done", callback_data="admin_restore_done")]])
+    )
+
 # ==============================================================================
 # 6. START COMMAND & BOT MENUS
 # ==============================================================================
 
 @bot.on_message(filters.command("start") & filters.private)
+@serialized
+@track_handler("start_cmd")
 @force_subscribe
 async def start_cmd(client, message: Message):
     user = message.from_user
@@ -599,7 +1991,7 @@ async def start_cmd(client, message: Message):
     # --- FILE RETRIEVAL SYSTEM ---
     if len(message.command) > 1:
         code = message.command[1]
-        file_data = await files_collection.find_one({"code": code})
+        file_data = await get_delivery_record(code)
         
         if file_data:
             msg = await message.reply_text("📂 **Fetching your file...**")
@@ -615,7 +2007,9 @@ async def start_cmd(client, message: Message):
                         file_id=file_data["file_id"],
                         caption=caption
                     )
-                except:
+                    FILE_DELIVERIES.labels("cached").inc()
+                except Exception as e:
+                    logger.warning(f"Cached send failed for {code}: {e}")
                     sent_msg = None
 
                 if not sent_msg and LOG_CHANNEL_ID and log_msg_id:
@@ -625,24 +2019,28 @@ async def start_cmd(client, message: Message):
                         message_id=log_msg_id,
                         caption=caption
                     )
+                    FILE_DELIVERIES.labels("fallback").inc()
+                    await repair_file_id(code, file_data, sent_msg)
                 
                 if sent_msg:
+                    analytics.record(code, file_data.get("uploader_id"), "deliveries")
                     await msg.delete()
                     if timer > 0:
                         asyncio.create_task(auto_delete_message(client, uid, sent_msg.id, timer))
                         await client.send_message(uid, f"⚠️ **Auto-Delete Enabled!**\n\nThis file will be deleted in **{int(timer/60)} minutes**.")
                 else:
+                    FILE_DELIVERIES.labels("failed").inc()
                     await msg.edit_text("❌ **Error:** File not found.")
 
             except Exception as e:
+                FILE_DELIVERIES.labels("failed").inc()
                 await msg.edit_text(f"❌ **Error:** {e}")
         else:
             await message.reply_text("❌ **Link Expired or Invalid.**")
         return
 
     # --- MAIN MENU ---
-    if uid in user_conversations:
-        del user_conversations[uid]
+    drop_session(uid)
         
     is_premium = await is_user_premium(uid)
     
@@ -672,6 +2070,8 @@ async def start_cmd(client, message: Message):
 # --- Callback Handler ---
 
 @bot.on_callback_query(filters.regex(r"^(admin_|my_account|api_help|request_movie)"))
+@serialized
+@track_handler("callback_handler")
 async def callback_handler(client, cb: CallbackQuery):
     data = cb.data
     uid = cb.from_user.id 
@@ -690,11 +2090,16 @@ async def callback_handler(client, cb: CallbackQuery):
         
     elif data.startswith("admin_") and uid == OWNER_ID:
         if data == "admin_stats":
-            total = await users_collection.count_documents({})
-            prem = await users_collection.count_documents({'is_premium': True})
-            files = await files_collection.count_documents({})
-            reqs = await requests_collection.count_documents({})
-            await cb.answer(f"📊 Total Users: {total}\n💎 Premium: {prem}\n📂 Files: {files}\n📨 Requests: {reqs}", show_alert=True)
+            stats = await read_stats()
+            await cb.answer(f"📊 Total Users: {stats.get('users', 0)}\n💎 Premium: {stats.get('premium', 0)}\n📂 Files: {stats.get('files', 0)}\n📨 Requests: {stats.get('requests', 0)}", show_alert=True)
+            
+        elif data == "admin_restore_done":
+            running = len(user_conversations.get(uid, {}).get("restore_jobs", ()))
+            if running:
+                return await cb.answer(f"⏳ {running} part(s) still restoring. Tap Done when they finish.", show_alert=True)
+            restored = user_conversations.pop(uid, {}).get("restored", {})
+            summary = "\n".join([f"• `{name}`: {count}" for name, count in restored.items()]) or "Nothing restored."
+            await cb.message.edit_text(f"✅ **Restore Session Closed.**\n\n{summary}")
             
         elif data == "admin_broadcast":
             await cb.message.edit_text("📢 **Broadcast Mode**\n\nSend message to broadcast.\n(Type /cancel to stop)")
@@ -709,15 +2114,18 @@ async def callback_handler(client, cb: CallbackQuery):
             user_conversations[uid] = {"state": "admin_rem_prem_wait"}
 
 @bot.on_callback_query(filters.regex("^cancel_req"))
+@serialized
+@track_handler("cancel_request")
 async def cancel_request(client, cb: CallbackQuery):
     uid = cb.from_user.id
-    if uid in user_conversations:
-        del user_conversations[uid]
+    drop_session(uid)
     await cb.message.edit_text("❌ **Request Cancelled.**")
 
 # --- Settings Commands ---
 
 @bot.on_message(filters.command(["setwatermark", "setapi", "setdomain", "settimer", "addchannel", "delchannel", "mychannels", "settutorial"]) & filters.private)
+@serialized
+@track_handler("settings_commands")
 @force_subscribe
 async def settings_commands(client, message: Message):
     cmd = message.command[0].lower()
@@ -726,27 +2134,27 @@ async def settings_commands(client, message: Message):
     if cmd == "setwatermark":
         text = " ".join(message.command[1:])
         if text.lower() in ['none', 'off', 'clear']: text = ""
-        await users_collection.update_one({'_id': uid}, {'$set': {'watermark_text': text}}, upsert=True)
+        await users_collection.update_one({'_id': uid}, {'$set': {'watermark_text': text}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
         await message.reply_text(f"✅ Watermark set: `{text}`")
 
     elif cmd == "setdomain":
         if len(message.command) > 1:
             domain = message.command[1].replace("https://", "").replace("http://", "").strip("/")
-            await users_collection.update_one({'_id': uid}, {'$set': {'shortener_url': domain}}, upsert=True)
+            await users_collection.update_one({'_id': uid}, {'$set': {'shortener_url': domain}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
             await message.reply_text(f"✅ Shortener Domain Saved: `{domain}`")
         else:
             await message.reply_text("❌ Usage: `/setdomain shareus.io`")
 
     elif cmd == "setapi":
         if len(message.command) > 1:
-            await users_collection.update_one({'_id': uid}, {'$set': {'shortener_api': message.command[1]}}, upsert=True)
+            await users_collection.update_one({'_id': uid}, {'$set': {'shortener_api': message.command[1]}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
             await message.reply_text("✅ API Key Saved.")
         else: await message.reply_text("❌ Usage: `/setapi KEY`")
 
     elif cmd == "settutorial":
         if len(message.command) > 1:
             link = message.command[1]
-            await users_collection.update_one({'_id': uid}, {'$set': {'tutorial_url': link}}, upsert=True)
+            await users_collection.update_one({'_id': uid}, {'$set': {'tutorial_url': link}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
             await message.reply_text(f"✅ Tutorial Link Saved.")
         else: await message.reply_text("❌ Usage: `/settutorial link`")
 
@@ -754,7 +2162,7 @@ async def settings_commands(client, message: Message):
         if len(message.command) > 1:
             try:
                 mins = int(message.command[1])
-                await users_collection.update_one({'_id': uid}, {'$set': {'delete_timer': mins*60}}, upsert=True)
+                await users_collection.update_one({'_id': uid}, {'$set': {'delete_timer': mins*60}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
                 await message.reply_text(f"✅ Timer set: **{mins} Minutes**")
             except: await message.reply_text("❌ Usage: `/settimer 10`")
         else:
@@ -764,7 +2172,7 @@ async def settings_commands(client, message: Message):
     elif cmd == "addchannel":
         if len(message.command) > 1:
             cid = message.command[1]
-            await users_collection.update_one({'_id': uid}, {'$addToSet': {'channel_ids': cid}}, upsert=True)
+            await users_collection.update_one({'_id': uid}, {'$addToSet': {'channel_ids': cid}, '$setOnInsert': {'created_at': datetime.now()}}, upsert=True)
             await message.reply_text(f"✅ Channel `{cid}` added.")
 
     elif cmd == "delchannel":
@@ -784,11 +2192,13 @@ async def settings_commands(client, message: Message):
 # ==============================================================================
 
 @bot.on_message(filters.command("trending") & filters.private)
+@serialized
+@track_handler("trending_cmd")
 @force_subscribe
 @check_premium
 async def trending_cmd(client, message: Message):
     msg = await message.reply_text("🔥 **Fetching Today's Trending Movies/Series...**")
-    results = await asyncio.to_thread(get_trending_today)
+    results = await get_trending_cached()
     
     if not results:
         return await msg.edit_text("❌ **Could not fetch trending data right now.**")
@@ -803,6 +2213,8 @@ async def trending_cmd(client, message: Message):
     await msg.edit_text(f"📈 **Top 10 Trending Today:**", reply_markup=InlineKeyboardMarkup(buttons))
 
 @bot.on_message(filters.command("post") & filters.private)
+@serialized
+@track_handler("post_search_cmd")
 @force_subscribe
 @check_premium
 async def post_search_cmd(client, message: Message):
@@ -817,9 +2229,10 @@ async def post_search_cmd(client, message: Message):
     results = []
     
     if search_type == "tmdb":
-        details = await asyncio.to_thread(get_tmdb_details, m_type, extracted_val)
+        details = await get_details_cached(m_type, extracted_val)
         if details:
             uid = message.from_user.id
+            drop_session(uid)
             user_conversations[uid] = {
                 "details": details,
                 "links": {},
@@ -835,12 +2248,12 @@ async def post_search_cmd(client, message: Message):
             return await msg.edit_text("❌ Invalid TMDB Link.")
 
     elif search_type == "imdb":
-        results = await asyncio.to_thread(search_by_imdb, extracted_val)
+        results = await search_by_imdb_shared(extracted_val)
         if not results:
              return await msg.edit_text("❌ IMDb ID not found in TMDB database.")
     
     else:
-        results = await asyncio.to_thread(search_tmdb, extracted_val)
+        results = await search_tmdb_shared(extracted_val)
 
     if not results:
         return await msg.edit_text("❌ **No results found!**\nTry checking the spelling or use an IMDb link.")
@@ -859,6 +2272,8 @@ async def post_search_cmd(client, message: Message):
 # ==============================================================================
 
 @bot.on_message(filters.command("manual") & filters.private)
+@serialized
+@track_handler("manual_cmd_start")
 @force_subscribe
 async def manual_cmd_start(client, message: Message):
     await message.reply_text(
@@ -870,10 +2285,12 @@ async def manual_cmd_start(client, message: Message):
     )
 
 @bot.on_callback_query(filters.regex("^manual_type_"))
+@serialized
+@track_handler("manual_type_handler")
 async def manual_type_handler(client, cb: CallbackQuery):
     m_type = cb.data.split("_")[2]
     uid = cb.from_user.id
-    
+    drop_session(uid)
     user_conversations[uid] = {
         "details": {"media_type": m_type},
         "links": {},
@@ -887,12 +2304,15 @@ async def manual_type_handler(client, cb: CallbackQuery):
 # ==============================================================================
 
 @bot.on_callback_query(filters.regex("^sel_"))
+@serialized
+@track_handler("media_selected")
 async def media_selected(client, cb: CallbackQuery):
     _, m_type, mid = cb.data.split("_")
-    details = await asyncio.to_thread(get_tmdb_details, m_type, mid)
+    details = await get_details_cached(m_type, mid)
     if not details: return await cb.answer("Error fetching details!", show_alert=True)
     
     uid = cb.from_user.id
+    drop_session(uid)
     user_conversations[uid] = {
         "details": details,
         "links": {},
@@ -907,6 +2327,8 @@ async def media_selected(client, cb: CallbackQuery):
     await cb.message.edit_text(f"✅ Selected: **{details.get('title') or details.get('name')}**\n\n🌐 **Select Language:**", reply_markup=InlineKeyboardMarkup(buttons))
 
 @bot.on_callback_query(filters.regex("^lang_"))
+@serialized
+@track_handler("language_selected")
 async def language_selected(client, cb: CallbackQuery):
     data = cb.data.split("_")[1]
     uid = cb.from_user.id
@@ -967,12 +2389,15 @@ async def show_upload_panel(message, uid, is_edit=False):
         await message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
 
 @bot.on_callback_query(filters.regex("^toggle_batch"))
+@serialized
+@track_handler("toggle_batch_handler")
 async def toggle_batch_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     convo = user_conversations.get(uid)
     if not convo: return await cb.answer("Session expired.", show_alert=True)
     
     if convo.get("is_batch_mode", False):
+        await finish_ingest(convo)
         convo["is_batch_mode"] = False
         convo["batch_season_prefix"] = None 
         await cb.answer("🔴 Batch Mode Disabled.", show_alert=True)
@@ -991,6 +2416,8 @@ async def toggle_batch_handler(client, cb: CallbackQuery):
         )
 
 @bot.on_callback_query(filters.regex("^batch_skip_season"))
+@serialized
+@track_handler("batch_skip_season_handler")
 async def batch_skip_season_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     convo = user_conversations.get(uid)
@@ -1009,12 +2436,16 @@ async def batch_skip_season_handler(client, cb: CallbackQuery):
     )
 
 @bot.on_callback_query(filters.regex("^add_custom_btn"))
+@serialized
+@track_handler("add_custom_btn_handler")
 async def add_custom_btn_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     user_conversations[uid]["state"] = "wait_custom_btn_name"
     await cb.message.edit_text("📝 **Enter Custom Button Name:**\n(e.g. Episode 1, Zip File)")
 
 @bot.on_callback_query(filters.regex("^up_"))
+@serialized
+@track_handler("upload_request")
 async def upload_request(client, cb: CallbackQuery):
     qual = cb.data.split("_")[1]
     uid = cb.from_user.id
@@ -1030,15 +2461,20 @@ async def upload_request(client, cb: CallbackQuery):
     )
 
 @bot.on_callback_query(filters.regex("^set_badge"))
+@serialized
+@track_handler("badge_menu_handler")
 async def badge_menu_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     user_conversations[uid]["state"] = "wait_badge_text"
     await cb.message.edit_text("✍️ **Enter the text for the Badge:**\n(e.g., 4K HDR, Dual Audio) or 'None'")
 
 @bot.on_callback_query(filters.regex("^back_panel"))
+@serialized
+@track_handler("back_button")
 async def back_button(client, cb: CallbackQuery):
     uid = cb.from_user.id
     if uid in user_conversations:
+        await finish_ingest(user_conversations[uid])
         user_conversations[uid]["is_batch_mode"] = False
         user_conversations[uid]["batch_season_prefix"] = None
     await show_upload_panel(cb.message, uid, is_edit=True)
@@ -1048,6 +2484,8 @@ async def back_button(client, cb: CallbackQuery):
 # ==============================================================================
 
 @bot.on_message(filters.command("addep") & filters.private)
+@serialized
+@track_handler("add_episode_cmd")
 @force_subscribe
 @check_premium
 async def add_episode_cmd(client, message: Message):
@@ -1079,11 +2517,13 @@ async def add_episode_cmd(client, message: Message):
         return await message.reply_text(f"❌ **Error accessing post:** {e}\n(Make sure Bot is Admin)")
 
     uid = message.from_user.id
+    drop_session(uid)
     user_conversations[uid] = {
         "state": "wait_file_for_edit",
         "edit_chat_id": chat_id,
         "edit_msg_id": msg_id,
-        "old_markup": target_msg.reply_markup
+        "old_markup": target_msg.reply_markup,
+        "post_title": parse_post_title(target_msg.caption or target_msg.text)
     }
     
     await message.reply_text(
@@ -1093,6 +2533,8 @@ async def add_episode_cmd(client, message: Message):
     )
 
 @bot.on_callback_query(filters.regex("^repost_"))
+@serialized
+@track_handler("repost_handler")
 async def repost_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     convo = user_conversations.get(uid)
@@ -1131,13 +2573,14 @@ async def repost_handler(client, cb: CallbackQuery):
                 f"👇 Click below to watch."
             )
             
-            await client.send_message(
-                chat_id=chat_id,
-                text=alert_text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🎬 Watch Now", url=post_link)]
-                ])
-            )
+            with bulk_traffic():
+                await client.send_message(
+                    chat_id=chat_id,
+                    text=alert_text,
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("🎬 Watch Now", url=post_link)]
+                    ])
+                )
             await cb.message.edit_text(f"✅ **Alert Sent!**\nNotification sent for **{update_text}**.")
             
     except Exception as e:
@@ -1147,11 +2590,559 @@ async def repost_handler(client, cb: CallbackQuery):
     if uid in user_conversations:
         del user_conversations[uid]
 
+# ==============================================================================
+# UPLOAD INGEST PIPELINE
+# ==============================================================================
+
+def build_long_url(code: str, bot_uname: str) -> str:
+    if BLOG_URL and "http" in BLOG_URL:
+        return f"{BLOG_URL.rstrip('/')}/?code={code}"
+    return f"https://t.me/{bot_uname}?start={code}"
+
+def build_file_caption(convo: dict, btn_name: str, bot_uname: str) -> str:
+    details = convo['details']
+    title = details.get('title') or details.get('name') or "Unknown"
+    date = details.get("release_date") or details.get("first_air_date") or "----"
+    year = date[:4]
+    lang = convo.get("language", "Unknown")
+
+    if isinstance(details.get("genres"), list) and len(details["genres"]) > 0:
+        if isinstance(details["genres"][0], dict):
+            genre_str = ", ".join([g["name"] for g in details.get("genres", [])[:3]])
+        else:
+            genre_str = str(details.get("genres")[0])
+    else:
+        genre_str = "N/A"
+
+    return (
+        f"🎬 **{title} ({year})**\n"
+        f"🔰 **Quality:** {btn_name}\n"
+        f"🔊 **Language:** {lang}\n"
+        f"🎭 **Genre:** {genre_str}\n"
+        f"━━━━━━━━━━━━━━━━━━\n"
+        f"🤖 @{bot_uname}"
+    )
+
+# Uploads are keyed by Telegram's file_unique_id: a file seen before reuses its
+# log message, file_id and code instead of being copied and stored again.
+EXISTING_FILE_PROJECTION = {"_id": 0, "code": 1, "file_unique_id": 1, "short_links": 1}
+
+async def find_file_by_unique_id(file_unique_id: str):
+    return await files_collection.find_one({"file_unique_id": file_unique_id}, EXISTING_FILE_PROJECTION)
+
+async def reuse_file_link(uid: int, existing: dict, bot_uname: str) -> str:
+    FILE_DEDUP.inc()
+    short_link = (existing.get("short_links") or {}).get(str(uid))
+    if short_link:
+        return short_link
+    long_url = build_long_url(existing["code"], bot_uname)
+    short_link = await shorten_link(uid, long_url)
+    if short_link != long_url:
+        await files_collection.update_one({"code": existing["code"]}, {"$set": {f"short_links.{uid}": short_link}})
+    return short_link
+
+def build_file_record(uid: int, code: str, log_msg, file_unique_id: str, caption: str,
+                      delete_timer: int, long_url: str, short_link: str) -> dict:
+    record = {
+        "code": code, 
+        "file_id": get_file_media(log_msg).file_id, 
+        "file_unique_id": file_unique_id,
+        "log_msg_id": log_msg.id,
+        "caption": caption, 
+        "delete_timer": delete_timer,
+        "uploader_id": uid, 
+        "created_at": datetime.now()
+    }
+    if short_link != long_url:
+        record["short_links"] = {str(uid): short_link}
+    return record
+
+async def store_uploaded_file(uid: int, message, log_caption: str, file_caption: str, delete_timer: int):
+    """Backup, record and shorten one upload (or reuse an identical earlier one). Returns (code, short_link)."""
+    bot_uname = await get_bot_username()
+    file_unique_id = get_file_media(message).file_unique_id
+    existing = await find_file_by_unique_id(file_unique_id)
+    if existing:
+        return existing["code"], await reuse_file_link(uid, existing, bot_uname)
+
+    with bulk_traffic():
+        log_msg = await message.copy(chat_id=LOG_CHANNEL_ID, caption=log_caption)
+    code = generate_random_code()
+    long_url = build_long_url(code, bot_uname)
+    short_link = await shorten_link(uid, long_url)
+    try:
+        await files_collection.insert_one(
+            build_file_record(uid, code, log_msg, file_unique_id, file_caption, delete_timer, long_url, short_link)
+        )
+    except DuplicateKeyError:
+        # The same file was stored concurrently; use the record that won.
+        existing = await find_file_by_unique_id(file_unique_id)
+        if not existing:
+            raise
+        return existing["code"], await reuse_file_link(uid, existing, bot_uname)
+    await bump_stats(files=1)
+    return code, short_link
+
+async def ingest_file(uid: int, convo: dict, message, btn_name: str, delete_timer: int):
+    """Backup one file to the log channel, store it and add its short link to the session."""
+    bot_uname = await get_bot_username()
+    code, short_link = await store_uploaded_file(
+        uid, message, f"#BACKUP\nUser: {uid}\nItem: {btn_name}",
+        build_file_caption(convo, btn_name, bot_uname), delete_timer
+    )
+    convo['links'][btn_name] = short_link
+    await message.delete()
+    await fulfill_requests(session_title(convo), code, short_link, convo)
+    return short_link
+
+async def ingest_album(client, uid: int, convo: dict, items: list, delete_timer: int):
+    """Store a whole media group: one copy_media_group, one insert_many, one delete."""
+    items = sorted(items, key=lambda item: item[0].id)
+    bot_uname = await get_bot_username()
+    unique_ids = [get_file_media(message).file_unique_id for message, _ in items]
+    existing = {
+        doc["file_unique_id"]: doc
+        async for doc in files_collection.find({"file_unique_id": {"$in": unique_ids}}, EXISTING_FILE_PROJECTION)
+    }
+    fresh = [(message, btn_name, unique_id) for (message, btn_name), unique_id in zip(items, unique_ids) if unique_id not in existing]
+
+    # Copies keep the file_unique_id, which maps them back to the source items
+    # even if the album also held photos or files we did not accept. Albums with
+    # already-known files are copied item by item so nothing is backed up twice.
+    copied_by_unique_id = {}
+    if fresh and len(fresh) == len(items):
+        names = ", ".join([btn_name for _, btn_name in items])
+        try:
+            with bulk_traffic():
+                copied = await client.copy_media_group(
+                    LOG_CHANNEL_ID, from_chat_id=uid, message_id=items[0][0].id,
+                    captions=f"#BACKUP\nUser: {uid}\nItems: {names}"
+                )
+            for log_msg in copied:
+                media = get_file_media(log_msg)
+                if media:
+                    copied_by_unique_id[media.file_unique_id] = log_msg
+        except Exception as e:
+            logger.warning(f"Album copy failed, copying files one by one: {e}")
+
+    codes = [generate_random_code() for _ in fresh]
+    long_urls = [build_long_url(code, bot_uname) for code in codes]
+    short_links = await asyncio.gather(*[shorten_link(uid, url) for url in long_urls])
+
+    records = []
+    for (message, btn_name, unique_id), code, long_url, short_link in zip(fresh, codes, long_urls, short_links):
+        log_msg = copied_by_unique_id.get(unique_id)
+        if log_msg is None:
+            with bulk_traffic():
+                log_msg = await message.copy(chat_id=LOG_CHANNEL_ID, caption=f"#BACKUP\nUser: {uid}\nItem: {btn_name}")
+        records.append(build_file_record(
+            uid, code, log_msg, unique_id, build_file_caption(convo, btn_name, bot_uname), delete_timer, long_url, short_link
+        ))
+
+    if records:
+        failed = set()
+        try:
+            await files_collection.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+        await bump_stats(files=len(records) - len(failed))
+        # Only stored records get a button; the session never links a dead code.
+        for index in range(len(records)):
+            if index not in failed:
+                convo['links'][fresh[index][1]] = short_links[index]
+        # Records that lost a race to an identical concurrent upload reuse the winner.
+        for index in failed:
+            winner = await find_file_by_unique_id(records[index]["file_unique_id"])
+            if not winner:
+                raise RuntimeError(f"Could not store {fresh[index][1]}")
+            existing[records[index]["file_unique_id"]] = winner
+
+    for (message, btn_name), unique_id in zip(items, unique_ids):
+        if unique_id in existing:
+            convo['links'][btn_name] = await reuse_file_link(uid, existing[unique_id], bot_uname)
+
+    try: await client.delete_messages(uid, [message.id for message, _ in items])
+    except Exception: pass
+
+    first_id, first_name = unique_ids[0], items[0][1]
+    first_code = existing[first_id]["code"] if first_id in existing else next(
+        record["code"] for record in records if record["file_unique_id"] == first_id
+    )
+    await fulfill_requests(session_title(convo), first_code, convo['links'][first_name], convo)
+
+class AlbumBuffer:
+    """Collects the messages of one media group until it has been quiet for MEDIA_GROUP_WAIT."""
+
+    def __init__(self, client, uid: int, convo: dict, group_id: str, is_batch: bool):
+        self.client = client
+        self.uid = uid
+        self.convo = convo
+        self.group_id = group_id
+        self.is_batch = is_batch
+        self.items = []
+        self._timer = None
+
+    def add(self, message, btn_name: str):
+        self.items.append((message, btn_name))
+        if self._timer:
+            self._timer.cancel()
+        self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(MEDIA_GROUP_WAIT)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self.convo.get("albums", {}).pop(self.group_id, None) is None:
+            return
+        items = self.items
+
+        if self.is_batch:
+            ingest = self.convo.get("ingest")
+            if ingest is None:
+                ingest = self.convo["ingest"] = BatchIngest(self.uid, self.convo)
+            ingest.submit_album(self.client, items)
+            await ingest.ensure_status(items[0][0])
+            return
+
+        # Tracked on the session before any await, so finish_ingest() can wait for it.
+        jobs = self.convo.setdefault("album_jobs", set())
+        job = asyncio.create_task(self._ingest_single(items))
+        jobs.add(job)
+        job.add_done_callback(jobs.discard)
+        await job
+
+    async def _ingest_single(self, items: list):
+        # Single-quality upload: every file after the first becomes an extra part.
+        items = [(message, btn_name if i == 0 else f"{btn_name} Part {i + 1}")
+                 for i, (message, btn_name) in enumerate(sorted(items, key=lambda item: item[0].id))]
+        status_msg = await items[0][0].reply_text(f"🔄 **Processing album ({len(items)} files)...**")
+        try:
+            await ingest_album(self.client, self.uid, self.convo, items, await get_delete_timer(self.uid))
+            await show_upload_panel(status_msg, self.uid, is_edit=False)
+        except Exception as e:
+            logger.error(f"Album Upload Error: {e}")
+            await status_msg.edit_text(f"❌ **Error:** {str(e)}")
+
+async def get_delete_timer(uid: int) -> int:
+    user_data = await users_collection.find_one({'_id': uid}, {'delete_timer': 1})
+    return (user_data or {}).get('delete_timer', 0)
+
+class BatchIngest:
+    """Per-session batch pipeline: episodes are numbered on arrival, then several
+    files are copied/stored/shortened at once behind one progress message."""
+
+    def __init__(self, uid: int, convo: dict):
+        self.uid = uid
+        self.convo = convo
+        self.semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+        self.tasks = set()
+        self.total = 0
+        self.saved = []
+        self.failed = []
+        self.status_msg = None
+        self._status_requested = False
+        self._refresh_pending = False
+        self._last_refresh = 0
+        self._delete_timer = None
+
+    def submit(self, message, btn_name: str):
+        self._start([btn_name], lambda timer: ingest_file(self.uid, self.convo, message, btn_name, timer))
+
+    def submit_album(self, client, items: list):
+        names = [btn_name for _, btn_name in items]
+        self._start(names, lambda timer: ingest_album(client, self.uid, self.convo, items, timer))
+
+    def _start(self, names: list, work):
+        self.total += len(names)
+        task = asyncio.create_task(self._run(names, work))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, names: list, work):
+        async with self.semaphore:
+            try:
+                if self._delete_timer is None:
+                    self._delete_timer = await get_delete_timer(self.uid)
+                await work(self._delete_timer)
+                self.saved.extend(names)
+            except Exception as e:
+                logger.error(f"Batch Upload Error ({', '.join(names)}): {e}")
+                self.failed.extend(names)
+        await self.refresh()
+
+    async def ensure_status(self, message):
+        if self._status_requested:
+            return
+        self._status_requested = True
+        self.status_msg = await message.reply_text(self.render())
+
+    def render(self) -> str:
+        pending = self.total - len(self.saved) - len(self.failed)
+        text = (f"📦 **Batch Upload**\n\n"
+                f"✅ Saved: **{len(self.saved)}/{self.total}**\n"
+                f"⏳ Processing: **{pending}**")
+        if self.failed:
+            text += f"\n❌ Failed: {', '.join(self.failed)}"
+        if self.saved:
+            text += f"\n\n🆕 Last saved: {', '.join(self.saved[-3:])}"
+        return text + "\n\n👇 **Send more episodes...**\n(Or click Stop to finish)"
+
+    async def refresh(self, final: bool = False):
+        if not self.status_msg:
+            return
+        if not final:
+            # Coalesce edits: at most one every 2s, the last one always lands.
+            if self._refresh_pending:
+                return
+            wait = self._last_refresh + 2 - time.monotonic()
+            if wait > 0:
+                self._refresh_pending = True
+                await asyncio.sleep(wait)
+                self._refresh_pending = False
+        self._last_refresh = time.monotonic()
+        try:
+            await self.status_msg.edit_text(
+                self.render(),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Stop / Finish Batch", callback_data="back_panel")]])
+            )
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.warning(f"Batch Status Error: {e}")
+
+    async def drain(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        await self.refresh(final=True)
+
+def buffer_album_item(client, uid: int, convo: dict, message, btn_name: str, is_batch: bool):
+    albums = convo.setdefault("albums", {})
+    album = albums.get(message.media_group_id)
+    if album is None:
+        album = albums[message.media_group_id] = AlbumBuffer(client, uid, convo, message.media_group_id, is_batch)
+    album.add(message, btn_name)
+
+async def finish_ingest(convo: dict):
+    for album in list(convo.get("albums", {}).values()):
+        await album.flush()
+    # Albums whose quiet-period flush started before this call.
+    if convo.get("album_jobs"):
+        await asyncio.gather(*list(convo["album_jobs"]), return_exceptions=True)
+    ingest = convo.pop("ingest", None)
+    if ingest:
+        await ingest.drain()
+
+def cancel_ingest(convo: dict):
+    """Stop the session's pending album timers and in-flight uploads."""
+    for album in convo.pop("albums", {}).values():
+        if album._timer:
+            album._timer.cancel()
+    for job in list(convo.get("album_jobs", ())):
+        job.cancel()
+    ingest = convo.pop("ingest", None)
+    if ingest:
+        for task in list(ingest.tasks):
+            task.cancel()
+
+def drop_session(uid: int):
+    convo = user_conversations.pop(uid, None)
+    if convo:
+        cancel_ingest(convo)
+    return convo
+
 # ==============================================================================
 # 11. MAIN MESSAGE HANDLER (TEXT & FILES)
 # ==============================================================================
 
-@bot.on_message(filters.private & (filters.text | filters.video | filters.document | filters.photo) & ~filters.command(["start", "post", "manual", "addep", "cancel", "trending", "settings", "backup", "setwatermark", "setapi", "setdomain", "settimer", "addchannel", "delchannel", "mychannels", "settutorial", "stats", "broadcast", "addpremium", "rempremium"]))
+# --- Auto-Reply Admission Control ---
+# Free-text searches are the most expensive update (TMDB + catalog scan +
+# shortener calls + request logging), so they pass three gates: repeats of
+# the same text inside SEARCH_DEBOUNCE are dropped, each user has a token
+# bucket, and at most SEARCH_CONCURRENCY run at once with SEARCH_QUEUE_LIMIT
+# waiting. Anything over is answered with a cheap canned reply.
+SEARCH_NOTICE_INTERVAL = 30
+
+class SearchAdmission:
+    def __init__(self):
+        self.users = LRUCache("search_admission", maxsize=20000, ttl=600)
+        self.semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+        self.waiting = 0
+
+    def check(self, uid: int, text: str):
+        """None if the search may run, else the reason it is shed."""
+        now = time.monotonic()
+        entry = self.users.get(uid)
+        if entry is None:
+            entry = {"bucket": TokenBucket(SEARCH_RATE, SEARCH_BURST), "text": None, "at": 0.0, "noticed": 0.0}
+            self.users.set(uid, entry)
+        key = " ".join(text.lower().split())
+        if key == entry["text"] and now - entry["at"] < SEARCH_DEBOUNCE:
+            return "debounced"
+        entry["text"], entry["at"] = key, now
+        if entry["bucket"].delay() > 0:
+            return "rate_limited"
+        if self.waiting >= SEARCH_QUEUE_LIMIT:
+            return "busy"
+        entry["bucket"].take()
+        SEARCH_ADMISSION.labels("admitted").inc()
+        return None
+
+    def should_notice(self, uid: int) -> bool:
+        entry = self.users.get(uid)
+        now = time.monotonic()
+        if not entry or now - entry["noticed"] < SEARCH_NOTICE_INTERVAL:
+            return False
+        entry["noticed"] = now
+        return True
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+search_admission = SearchAdmission()
+
+async def shed_search(message: Message, uid: int, reason: str):
+    SEARCH_ADMISSION.labels(reason).inc()
+    if reason == "debounced" or not search_admission.should_notice(uid):
+        return
+    if reason == "rate_limited":
+        await message.reply_text("⏳ **Too many requests!** Please wait a little and try again.")
+    else:
+        await message.reply_text("🚦 **Server is busy right now.** Please try again in a minute.")
+
+async def auto_reply_search(client, message: Message, uid: int, request_text: str):
+    msg = await message.reply_text("🔍 **আপনার মুভিটি আমাদের ডাটাবেসে খোঁজা হচ্ছে...**\n(দয়া করে অপেক্ষা করুন)")
+    corrected_title = request_text
+    
+    try:
+        tmdb_results = await search_tmdb_shared(request_text)
+        if tmdb_results:
+            corrected_title = tmdb_results[0].get('title') or tmdb_results[0].get('name')
+        else:
+            corrected_title = request_text
+
+        clean_name = re.sub(r'[^a-zA-Z0-9\s]', ' ', corrected_title)
+        words = [w for w in clean_name.split() if len(w) > 1][:4] 
+        if not words: words = request_text.split()[:4]
+        
+        regex_pattern = "".join([f"(?=.*{re.escape(w)})" for w in words])
+        query = {"caption": {"$regex": regex_pattern, "$options": "i"}}
+        
+        found_files = await files_collection.find(query).to_list(length=10)
+        
+        if found_files:
+            buttons = []
+            languages = set()
+            genres = set()
+            
+            for f in found_files:
+                caption_text = f.get('caption', '')
+                
+                qual_match = re.search(r"Quality:\*\*\s*(.*?)\n", caption_text)
+                qual = qual_match.group(1).strip() if qual_match else "Download"
+                
+                lang_match = re.search(r"Language:\*\*\s*(.*?)\n", caption_text)
+                if lang_match and lang_match.group(1).strip() not in ["Unknown", "N/A"]:
+                    languages.add(lang_match.group(1).strip())
+                    
+                genre_match = re.search(r"Genre:\*\*\s*(.*?)\n", caption_text)
+                if genre_match and genre_match.group(1).strip() not in ["Unknown", "N/A"]:
+                    genres.add(genre_match.group(1).strip())
+                
+                bot_uname = await get_bot_username()
+                file_code = f['code']
+                
+                if BLOG_URL and "http" in BLOG_URL:
+                    base_blog = BLOG_URL.rstrip("/")
+                    final_long_url = f"{base_blog}/?code={file_code}"
+                else:
+                    final_long_url = f"https://t.me/{bot_uname}?start={file_code}"
+                
+                uploader_id = f.get('uploader_id', uid) 
+                short_link = await shorten_link(uploader_id, final_long_url)
+                
+                buttons.append([InlineKeyboardButton(f"📥 {qual}", url=short_link)])
+                
+            display_lang = ", ".join(languages) if languages else "Unknown"
+            display_genre = list(genres)[0] if genres else "Unknown"
+                
+            await msg.edit_text(
+                f"✅ **খুশির খবর!**\nআপনি যেই মুভিটি খুঁজছেন, তা আমাদের কাছে আগে থেকেই আপলোড করা আছে।\n\n"
+                f"🎬 **Name:** {corrected_title}\n"
+                f"🎭 **Genre:** {display_genre}\n"
+                f"🔊 **Language:** {display_lang}\n\n"
+                f"👇 নিচ থেকে সরাসরি ডাউনলোড করে নিন:",
+                reply_markup=InlineKeyboardMarkup(buttons)
+            )
+            user_conversations.pop(uid, None)
+            return
+    except Exception as e:
+        logger.error(f"Auto Reply Error: {e}")
+        pass 
+        
+    # Logged per title (TMDB-corrected when possible); LOG_CHANNEL_ID gets a periodic digest.
+    await log_request(uid, corrected_title, request_text)
+    
+    await msg.edit_text("⏳ **মুভিটি আমাদের ডাটাবেসে পাওয়া যায়নি।**\n\nআপনার রিকোয়েস্টটি অ্যাডমিনদের কাছে পাঠানো হয়েছে। খুব দ্রুত এটি আপলোড করা হবে!")
+    user_conversations.pop(uid, None)
+
+async def run_broadcast(message: Message, msg: Message):
+    with bulk_traffic():
+        async for u in users_collection.find({}, {'_id': 1}):
+            try: await message.copy(chat_id=u['_id'])
+            except: pass
+    await msg.edit_text("✅ Broadcast complete.")
+
+async def restore_part(client, message: Message, convo: dict):
+    msg = await message.reply_text(f"⬇️ **Downloading** `{message.document.file_name}`...")
+    directory = tempfile.mkdtemp(prefix="restore_")
+    last_edit = 0
+
+    async def progress(counts):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < 3:
+            return
+        last_edit = time.monotonic()
+        done = ", ".join([f"{name}: {count}" for name, count in counts.items()])
+        try: await msg.edit_text(f"♻️ **Restoring...**\n📄 {done}")
+        except Exception: pass
+
+    try:
+        path = await client.download_media(message, file_name=os.path.join(directory, "part"))
+        counts, errors = await restore_backup_file(path, progress)
+        for name, count in counts.items():
+            convo["restored"][name] = convo["restored"].get(name, 0) + count
+        delivery_cache.clear()
+        await reconcile_stats()
+
+        summary = "\n".join([f"• `{name}`: {count}" for name, count in counts.items()]) or "No documents found."
+        error_text = f"\n⚠️ {errors} document(s) failed." if errors else ""
+        await msg.edit_text(
+            f"✅ **Part Restored!**\n\n{summary}{error_text}\n\n👉 Send the next part or tap Done.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ Done", callback_data="admin_restore_done")]])
+        )
+    except Exception as e:
+        logger.error(f"Restore Error: {e}")
+        await msg.edit_text(f"❌ **Restore Failed:** {e}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@bot.on_message(filters.private & (filters.text | filters.video | filters.document | filters.photo) & ~filters.command(["start", "post", "manual", "addep", "cancel", "trending", "settings", "backup", "setwatermark", "setapi", "setdomain", "settimer", "addchannel", "delchannel", "mychannels", "settutorial", "stats", "broadcast", "addpremium", "rempremium", "restore", "queue", "topfiles", "mystats"]))
+@serialized
+@track_handler("main_conversation_handler")
 async def main_conversation_handler(client, message: Message):
     uid = message.from_user.id
     convo = user_conversations.get(uid)
@@ -1173,90 +3164,11 @@ async def main_conversation_handler(client, message: Message):
         request_text = text
         if not request_text: return await message.reply_text("❌ Please send text only.")
         
-        msg = await message.reply_text("🔍 **আপনার মুভিটি আমাদের ডাটাবেসে খোঁজা হচ্ছে...**\n(দয়া করে অপেক্ষা করুন)")
-        
-        try:
-            tmdb_results = await asyncio.to_thread(search_tmdb, request_text)
-            if tmdb_results:
-                corrected_title = tmdb_results[0].get('title') or tmdb_results[0].get('name')
-            else:
-                corrected_title = request_text
-
-            clean_name = re.sub(r'[^a-zA-Z0-9\s]', ' ', corrected_title)
-            words = [w for w in clean_name.split() if len(w) > 1][:4] 
-            if not words: words = request_text.split()[:4]
-            
-            regex_pattern = "".join([f"(?=.*{re.escape(w)})" for w in words])
-            query = {"caption": {"$regex": regex_pattern, "$options": "i"}}
-            
-            found_files = await files_collection.find(query).to_list(length=10)
-            
-            if found_files:
-                buttons = []
-                languages = set()
-                genres = set()
-                
-                for f in found_files:
-                    caption_text = f.get('caption', '')
-                    
-                    qual_match = re.search(r"Quality:\*\*\s*(.*?)\n", caption_text)
-                    qual = qual_match.group(1).strip() if qual_match else "Download"
-                    
-                    lang_match = re.search(r"Language:\*\*\s*(.*?)\n", caption_text)
-                    if lang_match and lang_match.group(1).strip() not in ["Unknown", "N/A"]:
-                        languages.add(lang_match.group(1).strip())
-                        
-                    genre_match = re.search(r"Genre:\*\*\s*(.*?)\n", caption_text)
-                    if genre_match and genre_match.group(1).strip() not in ["Unknown", "N/A"]:
-                        genres.add(genre_match.group(1).strip())
-                    
-                    bot_uname = await get_bot_username()
-                    file_code = f['code']
-                    
-                    if BLOG_URL and "http" in BLOG_URL:
-                        base_blog = BLOG_URL.rstrip("/")
-                        final_long_url = f"{base_blog}/?code={file_code}"
-                    else:
-                        final_long_url = f"https://t.me/{bot_uname}?start={file_code}"
-                    
-                    uploader_id = f.get('uploader_id', uid) 
-                    short_link = await shorten_link(uploader_id, final_long_url)
-                    
-                    buttons.append([InlineKeyboardButton(f"📥 {qual}", url=short_link)])
-                    
-                display_lang = ", ".join(languages) if languages else "Unknown"
-                display_genre = list(genres)[0] if genres else "Unknown"
-                    
-                await msg.edit_text(
-                    f"✅ **খুশির খবর!**\nআপনি যেই মুভিটি খুঁজছেন, তা আমাদের কাছে আগে থেকেই আপলোড করা আছে।\n\n"
-                    f"🎬 **Name:** {corrected_title}\n"
-                    f"🎭 **Genre:** {display_genre}\n"
-                    f"🔊 **Language:** {display_lang}\n\n"
-                    f"👇 নিচ থেকে সরাসরি ডাউনলোড করে নিন:",
-                    reply_markup=InlineKeyboardMarkup(buttons)
-                )
-                user_conversations.pop(uid, None)
-                return
-        except Exception as e:
-            logger.error(f"Auto Reply Error: {e}")
-            pass 
-            
-        req_entry = {
-            "user_id": uid,
-            "user_name": message.from_user.first_name,
-            "request": request_text,
-            "date": datetime.now()
-        }
-        await requests_collection.insert_one(req_entry)
-        
-        if LOG_CHANNEL_ID:
-            await client.send_message(
-                LOG_CHANNEL_ID, 
-                f"📨 **New Request!**\n👤 User: {message.from_user.mention}\n📝 Request: `{request_text}`\n🤖 Auto-Search: `Not Found`"
-            )
-            
-        await msg.edit_text("⏳ **মুভিটি আমাদের ডাটাবেসে পাওয়া যায়নি।**\n\nআপনার রিকোয়েস্টটি অ্যাডমিনদের কাছে পাঠানো হয়েছে। খুব দ্রুত এটি আপলোড করা হবে!")
-        user_conversations.pop(uid, None)
+        reason = search_admission.check(uid, request_text)
+        if reason:
+            return await shed_search(message, uid, reason)
+        async with search_admission.slot():
+            await auto_reply_search(client, message, uid, request_text)
         return
 
     # ---------------------------------------------------------
@@ -1264,18 +3176,15 @@ async def main_conversation_handler(client, message: Message):
     # ---------------------------------------------------------
     if state == "admin_broadcast_wait":
         if uid != OWNER_ID: return
-        msg = await message.reply_text("📣 **Broadcasting...**")
-        async for u in users_collection.find({}):
-            try: await message.copy(chat_id=u['_id']); await asyncio.sleep(0.05)
-            except: pass
-        await msg.edit_text("✅ Broadcast complete.")
         user_conversations.pop(uid, None)
+        msg = await message.reply_text("📣 **Broadcasting...**")
+        dispatcher.spawn(run_broadcast(message, msg))
         return
         
     elif state == "admin_add_prem_wait":
         if uid != OWNER_ID: return
         try:
-            await users_collection.update_one({'_id': int(text)}, {'$set': {'is_premium': True}}, upsert=True)
+            await set_premium(int(text), True)
             await message.reply_text(f"✅ Premium Added to ID: `{text}`")
         except: await message.reply_text("❌ Invalid ID.")
         user_conversations.pop(uid, None)
@@ -1284,12 +3193,24 @@ async def main_conversation_handler(client, message: Message):
     elif state == "admin_rem_prem_wait":
         if uid != OWNER_ID: return
         try:
-            await users_collection.update_one({'_id': int(text)}, {'$set': {'is_premium': False}})
+            await set_premium(int(text), False)
             await message.reply_text(f"✅ Premium Removed from ID: `{text}`")
         except: await message.reply_text("❌ Invalid ID.")
         user_conversations.pop(uid, None)
         return
 
+    elif state == "admin_restore_wait":
+        if uid != OWNER_ID: return
+        if not message.document:
+            return await message.reply_text("❌ Please send a backup **file**.")
+
+        # Runs as a job so /stats, Done and further parts aren't queued behind it.
+        job = dispatcher.spawn(restore_part(client, message, convo))
+        jobs = convo.setdefault("restore_jobs", set())
+        jobs.add(job)
+        job.add_done_callback(jobs.discard)
+        return
+
     if state == "wait_batch_season_input":
         prefix = text.strip()
         convo["batch_season_prefix"] = prefix
@@ -1364,6 +3285,13 @@ async def main_conversation_handler(client, message: Message):
         convo["state"] = "wait_file_upload"
         await message.reply_text(f"📤 **Upload File for: '{text}'**\n👉 Send Video/File now.")
 
+    elif state == "wait_schedule_time":
+        run_at = parse_schedule_time(text)
+        if not run_at:
+            return await message.reply_text("❌ Invalid time. Use `21:30` or `2025-01-31 21:30`.")
+        convo["state"] = convo.pop("state_before_schedule", None)
+        await queue_post_to_all(client, uid, run_at)
+
     elif state == "wait_file_for_edit":
         if not (message.video or message.document):
             return await message.reply_text("❌ Please send a **Video** or **Document** file.")
@@ -1385,27 +3313,12 @@ async def main_conversation_handler(client, message: Message):
         status_msg = await message.reply_text("🔄 **Processing & Updating Channel Post...**")
         
         try:
-            log_msg = await file_msg.copy(chat_id=LOG_CHANNEL_ID, caption=f"#UPDATE_POST\nUser: {uid}\nItem: {button_name}")
-            backup_file_id = log_msg.video.file_id if log_msg.video else log_msg.document.file_id
-            
-            code = generate_random_code()
-            user_data = await users_collection.find_one({'_id': uid})
             file_caption = f"🎬 **{button_name}**\n━━━━━━━━━━━━━━\n🤖 @{await get_bot_username()}"
-            
-            await files_collection.insert_one({
-                "code": code, "file_id": backup_file_id, "log_msg_id": log_msg.id,
-                "caption": file_caption, "delete_timer": user_data.get('delete_timer', 0),
-                "uploader_id": uid, "created_at": datetime.now()
-            })
-            
-            bot_uname = await get_bot_username()
-            if BLOG_URL and "http" in BLOG_URL:
-                base_blog = BLOG_URL.rstrip("/")
-                final_long_url = f"{base_blog}/?code={code}"
-            else:
-                final_long_url = f"https://t.me/{bot_uname}?start={code}"
-            
-            short_link = await shorten_link(uid, final_long_url)
+            code, short_link = await store_uploaded_file(
+                uid, file_msg, f"#UPDATE_POST\nUser: {uid}\nItem: {button_name}",
+                file_caption, await get_delete_timer(uid)
+            )
+            await fulfill_requests(convo.get("post_title"), code, short_link)
             
             new_button = InlineKeyboardButton(button_name, url=short_link)
             current_keyboard = old_markup.inline_keyboard if old_markup else []
@@ -1451,85 +3364,41 @@ async def main_conversation_handler(client, message: Message):
         is_batch = convo.get("is_batch_mode", False)
         
         if is_batch:
+            # Number the episode before any await so arrival order decides it.
             count = convo.get("episode_count", 1)
+            convo["episode_count"] = count + 1
             season_prefix = convo.get("batch_season_prefix", None)
             
             if season_prefix:
                 btn_name = f"{season_prefix} E{count}" 
             else:
                 btn_name = f"Episode {count}" 
+
+            if message.media_group_id:
+                buffer_album_item(client, uid, convo, message, btn_name, is_batch=True)
+                return
+
+            ingest = convo.get("ingest")
+            if ingest is None:
+                ingest = convo["ingest"] = BatchIngest(uid, convo)
+            ingest.submit(message, btn_name)
+            await ingest.ensure_status(message)
+            return
         
         elif convo["current_quality"] == "custom": 
             btn_name = convo["temp_btn_name"]
         else: 
             btn_name = convo["current_quality"]
+
+        if message.media_group_id:
+            buffer_album_item(client, uid, convo, message, btn_name, is_batch=False)
+            return
         
         status_msg = await message.reply_text(f"🔄 **Processing '{btn_name}'...**")
         
         try:
-            log_msg = await message.copy(chat_id=LOG_CHANNEL_ID, caption=f"#BACKUP\nUser: {uid}\nItem: {btn_name}")
-            backup_file_id = log_msg.video.file_id if log_msg.video else log_msg.document.file_id
-            
-            details = convo['details']
-            title = details.get('title') or details.get('name') or "Unknown"
-            
-            date = details.get("release_date") or details.get("first_air_date") or "----"
-            year = date[:4]
-            
-            lang = convo.get("language", "Unknown")
-            
-            if isinstance(details.get("genres"), list) and len(details["genres"]) > 0:
-                if isinstance(details["genres"][0], dict):
-                    genre_str = ", ".join([g["name"] for g in details.get("genres", [])[:3]])
-                else:
-                    genre_str = str(details.get("genres")[0])
-            else:
-                genre_str = "N/A"
-
-            file_caption = (
-                f"🎬 **{title} ({year})**\n"
-                f"🔰 **Quality:** {btn_name}\n"
-                f"🔊 **Language:** {lang}\n"
-                f"🎭 **Genre:** {genre_str}\n"
-                f"━━━━━━━━━━━━━━━━━━\n"
-                f"🤖 @{await get_bot_username()}"
-            )
-            
-            code = generate_random_code()
-            user_data = await users_collection.find_one({'_id': uid})
-            
-            await files_collection.insert_one({
-                "code": code, 
-                "file_id": backup_file_id, 
-                "log_msg_id": log_msg.id,
-                "caption": file_caption, 
-                "delete_timer": user_data.get('delete_timer', 0),
-                "uploader_id": uid, 
-                "created_at": datetime.now()
-            })
-            
-            bot_uname = await get_bot_username()
-            
-            if BLOG_URL and "http" in BLOG_URL:
-                base_blog = BLOG_URL.rstrip("/")
-                final_long_url = f"{base_blog}/?code={code}"
-            else:
-                final_long_url = f"https://t.me/{bot_uname}?start={code}"
-            
-            short_link = await shorten_link(uid, final_long_url)
-            
-            convo['links'][btn_name] = short_link
-            
-            await message.delete()
-            
-            if is_batch:
-                convo["episode_count"] += 1
-                await status_msg.edit_text(
-                    f"✅ **{btn_name} Saved!**\n\n👇 **Send Next Episode...**\n(Or click Stop to finish)",
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Stop / Finish Batch", callback_data="back_panel")]])
-                )
-            else:
-                await show_upload_panel(status_msg, uid, is_edit=False)
+            await ingest_file(uid, convo, message, btn_name, await get_delete_timer(uid))
+            await show_upload_panel(status_msg, uid, is_edit=False)
             
         except Exception as e:
             logger.error(f"Upload Error: {e}")
@@ -1540,11 +3409,14 @@ async def main_conversation_handler(client, message: Message):
 # ==============================================================================
 
 @bot.on_callback_query(filters.regex("^proc_final"))
+@serialized
+@track_handler("process_final_post")
 async def process_final_post(client, cb: CallbackQuery):
     uid = cb.from_user.id
     convo = user_conversations.get(uid)
     
     if not convo: return await cb.answer("Session expired.", show_alert=True)
+    await finish_ingest(convo)
     if not convo['links']: return await cb.answer("❌ No files uploaded!", show_alert=True)
         
     await cb.message.edit_text("🖼️ **Generating Post... Please wait...**")
@@ -1556,7 +3428,7 @@ async def process_final_post(client, cb: CallbackQuery):
     # Auto fetch Trailer URL using Async Thread
     trailer_url = None
     if m_id and not convo.get('is_manual'):
-        trailer_url = await asyncio.to_thread(get_tmdb_trailer, m_type, m_id)
+        trailer_url = await get_trailer_cached(m_type, m_id)
     
     caption = await generate_channel_caption(
         convo['details'], convo.get('language', 'Unknown'), convo['links'], 
@@ -1607,7 +3479,8 @@ async def process_final_post(client, cb: CallbackQuery):
     if details.get('poster_local_path') and os.path.exists(details['poster_local_path']):
         poster_input = details['poster_local_path']
     elif details.get('poster_path'):
-        poster_input = f"https://image.tmdb.org/t/p/w500{details['poster_path']}"
+        poster_bytes = await get_poster_cached(details['poster_path'])
+        poster_input = io.BytesIO(poster_bytes) if poster_bytes else f"https://image.tmdb.org/t/p/w500{details['poster_path']}"
         
     # Process Image with Asyncio to prevent lag
     poster_buffer, error = await asyncio.to_thread(
@@ -1634,8 +3507,12 @@ async def process_final_post(client, cb: CallbackQuery):
     channel_btns = []
     
     if channels:
+        if len(channels) > 1:
+            channel_btns.append([InlineKeyboardButton(f"🚀 Post to All ({len(channels)})", callback_data="sndall")])
         for cid in channels:
             channel_btns.append([InlineKeyboardButton(f"📢 Post to: {cid}", callback_data=f"sndch_{cid}")])
+        channel_btns.append([InlineKeyboardButton("🕒 Queue to All (Next Slots)", callback_data="schall")])
+        channel_btns.append([InlineKeyboardButton("⏰ Schedule at Time", callback_data="schtime")])
     else:
         await client.send_message(uid, "⚠️ **No Channels Saved!** Add using `/addchannel <id>`.")
     
@@ -1644,6 +3521,8 @@ async def process_final_post(client, cb: CallbackQuery):
     await client.send_message(uid, "👇 **Select Channel to Publish:**", reply_markup=InlineKeyboardMarkup(channel_btns))
 
 @bot.on_callback_query(filters.regex("^sndch_"))
+@serialized
+@track_handler("send_to_channel_handler")
 async def send_to_channel_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     target_cid = cb.data.split("_")[1]
@@ -1653,14 +3532,223 @@ async def send_to_channel_handler(client, cb: CallbackQuery):
     
     data = convo['final_post_data']
     try:
-        await client.send_photo(
-            chat_id=int(target_cid), photo=data['file_id'], caption=data['caption'], reply_markup=InlineKeyboardMarkup(data['buttons'])
-        )
+        await send_final_post(client, target_cid, data)
         await cb.answer(f"✅ Posted to {target_cid}", show_alert=True)
     except Exception as e:
         await cb.answer(f"❌ Failed: {e}", show_alert=True)
 
+async def send_final_post(client, cid, data: dict):
+    await client.send_photo(
+        chat_id=int(cid), photo=data['file_id'], caption=data['caption'], reply_markup=InlineKeyboardMarkup(data['buttons'])
+    )
+
+async def publish_to_channel(client, cid, data: dict):
+    """Send the final post to one channel. Returns an error text or None."""
+    try:
+        await send_final_post(client, cid, data)
+        CHANNEL_POSTS.labels("ok").inc()
+        return None
+    except FloodWait as e:
+        CHANNEL_POSTS.labels("flood").inc()
+        return f"FloodWait {e.value}s"
+    except Exception as e:
+        CHANNEL_POSTS.labels("error").inc()
+        return str(e)
+
+@bot.on_callback_query(filters.regex("^sndall$"))
+@serialized
+@track_handler("send_to_all_channels_handler")
+async def send_to_all_channels_handler(client, cb: CallbackQuery):
+    uid = cb.from_user.id
+    convo = user_conversations.get(uid)
+    
+    if not convo or 'final_post_data' not in convo: return await cb.answer("❌ Session Expired.", show_alert=True)
+    if convo.get('publishing'): return await cb.answer("⏳ Already publishing...", show_alert=True)
+    
+    user_data = await users_collection.find_one({'_id': uid}, {'channel_ids': 1})
+    channels = (user_data or {}).get('channel_ids', [])
+    if not channels: return await cb.answer("⚠️ No Channels Saved!", show_alert=True)
+    
+    convo['publishing'] = True
+    await cb.answer(f"🚀 Publishing to {len(channels)} channels...")
+    status_msg = await client.send_message(uid, f"⏳ **Publishing to {len(channels)} channels...**")
+    
+    # The outbound scheduler paces the fan-out and waits out FloodWaits per channel.
+    try:
+        with bulk_traffic():
+            errors = await asyncio.gather(*[
+                publish_to_channel(client, cid, convo['final_post_data']) for cid in channels
+            ])
+    finally:
+        convo.pop('publishing', None)
+    
+    lines = [f"✅ `{cid}`" if not error else f"❌ `{cid}`: {error}" for cid, error in zip(channels, errors)]
+    ok = errors.count(None)
+    await status_msg.edit_text(
+        f"📢 **Published: {ok}/{len(channels)}**\n\n" + "\n".join(lines)
+    )
+
+# --- Scheduled Post Queue ---
+# Posts wait in `scheduled_posts` until run_at. Each channel gets at most one
+# post per POST_SLOT_INTERVAL; a single background publisher claims due posts
+# atomically (pending -> sending) and sends them one at a time as bulk traffic.
+SCHEDULE_MAX_ATTEMPTS = 3
+
+def pack_buttons(buttons: list) -> list:
+    return [[{"text": b.text, "url": b.url} for b in row] for row in buttons]
+
+def unpack_buttons(rows: list) -> list:
+    return [[InlineKeyboardButton(b["text"], url=b["url"]) for b in row] for row in rows]
+
+def parse_schedule_time(text: str):
+    """'HH:MM' (next occurrence) or 'YYYY-MM-DD HH:MM', server local time."""
+    text = (text or "").strip()
+    try:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M")
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(text, "%H:%M")
+    except ValueError:
+        return None
+    now = datetime.now()
+    run_at = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+async def next_channel_slot(cid: str, not_before: datetime) -> datetime:
+    last = await scheduled_collection.find_one(
+        {"channel_id": cid, "status": {"$ne": "cancelled"}}, {"run_at": 1}, sort=[("run_at", DESCENDING)]
+    )
+    if last and last["run_at"] + timedelta(seconds=POST_SLOT_INTERVAL) > not_before:
+        return last["run_at"] + timedelta(seconds=POST_SLOT_INTERVAL)
+    return not_before
+
+async def schedule_post(uid: int, data: dict, channels: list, not_before: datetime) -> list:
+    """Queue the post for every channel at its next free slot. Returns [(cid, run_at)]."""
+    slots = []
+    for cid in channels:
+        run_at = await next_channel_slot(cid, not_before)
+        await scheduled_collection.insert_one({
+            "user_id": uid, "channel_id": cid, "run_at": run_at, "status": "pending", "attempts": 0,
+            "photo": data['file_id'], "caption": data['caption'], "buttons": pack_buttons(data['buttons']),
+            "created_at": datetime.now()
+        })
+        slots.append((cid, run_at))
+    return slots
+
+async def queue_post_to_all(client, uid: int, not_before: datetime):
+    convo = user_conversations.get(uid)
+    if not convo or 'final_post_data' not in convo:
+        return await client.send_message(uid, "❌ Session Expired.")
+    user_data = await users_collection.find_one({'_id': uid}, {'channel_ids': 1})
+    channels = (user_data or {}).get('channel_ids', [])
+    if not channels:
+        return await client.send_message(uid, "⚠️ **No Channels Saved!** Add using `/addchannel <id>`.")
+    slots = await schedule_post(uid, convo['final_post_data'], channels, not_before)
+    lines = [f"🕒 `{cid}` → {run_at.strftime('%d %b %H:%M')}" for cid, run_at in slots]
+    await client.send_message(uid, "✅ **Post Queued!**\n\n" + "\n".join(lines) + "\n\nSee `/queue` to review.")
+
+async def publish_scheduled(client, post: dict):
+    data = {"file_id": post["photo"], "caption": post["caption"], "buttons": unpack_buttons(post["buttons"])}
+    try:
+        await send_final_post(client, post["channel_id"], data)
+    except FloodWait as e:
+        CHANNEL_POSTS.labels("flood").inc()
+        await scheduled_collection.update_one(
+            {"_id": post["_id"]},
+            {"$set": {"status": "pending", "run_at": datetime.now() + timedelta(seconds=e.value + 1)}}
+        )
+        return
+    except Exception as e:
+        CHANNEL_POSTS.labels("error").inc()
+        attempts = post.get("attempts", 0) + 1
+        if attempts < SCHEDULE_MAX_ATTEMPTS:
+            update = {"status": "pending", "attempts": attempts, "error": str(e),
+                      "run_at": datetime.now() + timedelta(seconds=60 * attempts)}
+        else:
+            update = {"status": "failed", "attempts": attempts, "error": str(e)}
+            try: await client.send_message(post["user_id"], f"❌ **Scheduled post to `{post['channel_id']}` failed:** {e}")
+            except Exception: pass
+        await scheduled_collection.update_one({"_id": post["_id"]}, {"$set": update})
+        return
+    CHANNEL_POSTS.labels("ok").inc()
+    await scheduled_collection.update_one(
+        {"_id": post["_id"]}, {"$set": {"status": "sent", "sent_at": datetime.now()}}
+    )
+
+async def scheduled_post_loop():
+    requeued = False
+    while True:
+        try:
+            if not requeued:
+                # There is only one publisher, so anything still 'sending' at startup
+                # was claimed by a process that died mid-send. Whether Telegram got
+                # the post is unknown, so delivery is at-least-once: a crash between
+                # send_photo and the 'sent' update can post it twice.
+                await scheduled_collection.update_many({"status": "sending"}, {"$set": {"status": "pending"}})
+                requeued = True
+            with scheduled_traffic():
+                while True:
+                    post = await scheduled_collection.find_one_and_update(
+                        {"status": "pending", "run_at": {"$lte": datetime.now()}},
+                        {"$set": {"status": "sending", "claimed_at": datetime.now()}},
+                        sort=[("run_at", ASCENDING)]
+                    )
+                    if not post:
+                        break
+                    await publish_scheduled(bot, post)
+        except Exception as e:
+            logger.error(f"Scheduled Post Error: {e}")
+        await asyncio.sleep(SCHEDULE_POLL_INTERVAL)
+
+@bot.on_callback_query(filters.regex("^schall$"))
+@serialized
+@track_handler("queue_to_all_handler")
+async def queue_to_all_handler(client, cb: CallbackQuery):
+    await cb.answer()
+    await queue_post_to_all(client, cb.from_user.id, datetime.now())
+
+@bot.on_callback_query(filters.regex("^schtime$"))
+@serialized
+@track_handler("schedule_time_handler")
+async def schedule_time_handler(client, cb: CallbackQuery):
+    convo = user_conversations.get(cb.from_user.id)
+    if not convo or 'final_post_data' not in convo: return await cb.answer("❌ Session Expired.", show_alert=True)
+    convo["state_before_schedule"] = convo.get("state")
+    convo["state"] = "wait_schedule_time"
+    await cb.answer()
+    await client.send_message(
+        cb.from_user.id,
+        f"⏰ **Send Publish Time** (server time, now `{datetime.now().strftime('%H:%M')}`)\n\n"
+        f"• `21:30` → next 21:30\n• `2025-01-31 21:30` → exact date\n\n"
+        f"Channels stay {POST_SLOT_INTERVAL // 60} mins apart."
+    )
+
+@bot.on_message(filters.command("queue") & filters.private)
+@serialized
+@track_handler("queue_cmd")
+async def queue_cmd(client, message: Message):
+    uid = message.from_user.id
+    if len(message.command) > 1 and message.command[1].lower() == "clear":
+        result = await scheduled_collection.update_many(
+            {"user_id": uid, "status": "pending"}, {"$set": {"status": "cancelled"}}
+        )
+        return await message.reply_text(f"🗑 **Cancelled {result.modified_count} queued posts.**")
+
+    posts = await scheduled_collection.find(
+        {"user_id": uid, "status": {"$in": ["pending", "sending"]}}, {"channel_id": 1, "run_at": 1, "caption": 1}
+    ).sort("run_at", ASCENDING).to_list(length=20)
+    if not posts:
+        return await message.reply_text("📭 **No queued posts.**")
+    lines = []
+    for post in posts:
+        title = (post.get("caption") or "").split("\n")[0][:40]
+        lines.append(f"🕒 {post['run_at'].strftime('%d %b %H:%M')} → `{post['channel_id']}`\n   {title}")
+    await message.reply_text("📋 **Queued Posts:**\n\n" + "\n".join(lines) + "\n\n🗑 `/queue clear` to cancel all.")
+
 @bot.on_callback_query(filters.regex("^close_post"))
+@serialized
+@track_handler("close_post_handler")
 async def close_post_handler(client, cb: CallbackQuery):
     uid = cb.from_user.id
     if uid in user_conversations:
@@ -1668,11 +3756,39 @@ async def close_post_handler(client, cb: CallbackQuery):
         if local_path and os.path.exists(local_path):
             try: os.remove(local_path)
             except: pass     
-        user_conversations.pop(uid, None)
+        drop_session(uid)
         
     await cb.message.delete()
     await cb.answer("✅ Session Closed.", show_alert=True)
 
+async def run_bot():
+    # Bind the health port first; index builds on a large collection can take
+    # longer than the platform's startup probe allows.
+    web_runner = await start_web_server()
+    background_tasks = [
+        asyncio.create_task(ensure_indexes()),
+        asyncio.create_task(loop_monitor.run()),
+        asyncio.create_task(stats_reconcile_loop()),
+        asyncio.create_task(scheduled_post_loop()),
+        asyncio.create_task(trending_warmer_loop()),
+        asyncio.create_task(request_digest_loop()),
+        asyncio.create_task(request_notify_loop()),
+        asyncio.create_task(user_flush_loop()),
+        asyncio.create_task(analytics_flush_loop()),
+    ]
+    await bot.start()
+    logger.info("✅ Bot started.")
+    await idle()
+
+    for task in background_tasks:
+        task.cancel()
+    # Let cancelled flushes put their in-flight batches back before the final flush.
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await flush_user_updates()
+    await analytics.flush()
+    await bot.stop()
+    await web_runner.cleanup()
+
 if __name__ == "__main__":
     logger.info("🚀 Bot is starting...")
-    bot.run()
+    bot.run(run_bot())